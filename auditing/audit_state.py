@@ -0,0 +1,109 @@
+""" Persisted state of incremental order fulfillment audits. """
+import json
+import logging
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class AuditState:
+    """ High-water mark of the last audited order, the orders audited recently, and the orders which were still
+    unfulfilled at that time.
+
+    Orders can be completed well after they were placed (e.g. long transactions, replica lag, re-fulfillment), so
+    each audit re-reads the orders placed during an overlap window before the mark. The numbers of the orders audited
+    during that window (`audited`, mapping numbers to dates placed) are kept so that they are not audited twice.
+
+    Pending orders are stored as dicts with the columns returned by `get_orders`, plus the time at which the order
+    was first identified as unfulfilled (`first_seen`).
+    """
+
+    def __init__(self, path, date_placed=None, number=None, pending=None, audited=None):
+        self.path = path
+        self.date_placed = date_placed
+        self.number = number
+        self.pending = pending or []
+        self.audited = audited or {}
+
+    @classmethod
+    def load(cls, path):
+        """ Load the state stored at the given path. A blank state is returned if the file does not exist. """
+        if not os.path.exists(path):
+            logger.info('No audit state found at [%s]. Starting a new incremental audit.', path)
+            return cls(path)
+
+        with open(path) as f:
+            data = json.load(f)
+
+        date_placed = data.get('date_placed')
+        pending = [
+            dict(order, date_placed=_parse_date(order['date_placed']), first_seen=_parse_date(order['first_seen']))
+            for order in data.get('pending', [])
+        ]
+        audited = {number: _parse_date(value) for number, value in data.get('audited', {}).items()}
+        return cls(path, _parse_date(date_placed) if date_placed else None, data.get('number'), pending, audited)
+
+    def save(self):
+        """ Persist the state. The file is replaced atomically, so a crash never leaves a truncated state behind. """
+        data = {
+            'date_placed': _format_date(self.date_placed) if self.date_placed else None,
+            'number': self.number,
+            'pending': [
+                dict(order, date_placed=_format_date(order['date_placed']),
+                     first_seen=_format_date(order['first_seen']), total_excl_tax=str(order['total_excl_tax']))
+                for order in self.pending
+            ],
+            'audited': {number: _format_date(value) for number, value in self.audited.items()},
+        }
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def advance(self, date_placed, number):
+        """ Move the high-water mark forward to the given order, if it was placed after the current mark. """
+        if self.date_placed is None or (date_placed, number) > (self.date_placed, self.number):
+            self.date_placed = date_placed
+            self.number = number
+
+    def record(self, numbers, dates_placed):
+        """ Record the given orders as audited. """
+        self.audited.update(zip(numbers, dates_placed))
+
+    def forget_before(self, date_placed):
+        """ Forget the audited orders placed before the given date, which will no longer be re-read. """
+        self.audited = {number: value for number, value in self.audited.items() if value >= date_placed}
+
+    def carry_forward(self, unfulfilled_orders, now, grace_period):
+        """ Replace the pending orders with the given unfulfilled orders.
+
+        Orders which have been unfulfilled for longer than the grace period are no longer carried forward.
+
+        Arguments:
+            unfulfilled_orders (list of dict): Orders identified as unfulfilled by the current audit.
+            now (datetime): Time of the current audit.
+            grace_period (timedelta): How long an unfulfilled order is re-checked by subsequent audits.
+        """
+        first_seen = {order['number']: order['first_seen'] for order in self.pending}
+        pending = []
+        for order in unfulfilled_orders:
+            order = dict(order, first_seen=first_seen.get(order['number'], now))
+            if now - order['first_seen'] <= grace_period:
+                pending.append(order)
+            else:
+                logger.warning('Order [%s] has been unfulfilled since [%s], and will no longer be re-checked.',
+                               order['number'], order['first_seen'])
+
+        self.pending = pending
+
+
+def _format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT)
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+""" Micro-benchmark for the removal of upgraded (honor) orders.
+
+Compares the vectorized `remove_upgraded_orders` against the original implementation, which dropped duplicate
+rows one (username, course_id) group at a time. The original implementation is quadratic, so it is only run
+against a sample of the synthetic orders.
+
+    python benchmark_upgrades.py --orders 1000000 --legacy-orders 20000
+"""
+import argparse
+import logging
+import timeit
+
+import numpy
+import pandas
+
+from order_fulfillment import remove_upgraded_orders
+
+
+def build_orders(count, upgrade_ratio=0.1, seed=0):
+    """ Build a synthetic orders DataFrame, shaped like the result of `get_orders`.
+
+    Roughly `upgrade_ratio` of the (username, course_id) pairs have both an honor and a later verified order.
+    """
+    random = numpy.random.RandomState(seed)
+    pairs = int(count / (1 + upgrade_ratio))
+    upgraded = random.choice(pairs, count - pairs, replace=False)
+
+    # Each user purchases three distinct courses.
+    pair_ids = numpy.arange(pairs)
+    usernames = numpy.array(['user{}'.format(i) for i in pair_ids // 3])
+    course_ids = numpy.array(['course-v1:edX+C{}+1T2017'.format(i) for i in (pair_ids * 7919) % 5000])
+    date_placed = pandas.Timestamp('2017-01-01') + pandas.to_timedelta(random.randint(0, 86400, pairs), unit='s')
+    upgrade_date_placed = date_placed[upgraded] + pandas.Timedelta(days=1)
+
+    orders = pandas.DataFrame({
+        'username': numpy.concatenate([usernames, usernames[upgraded]]),
+        'number': ['EDX-{}'.format(100000 + i) for i in range(count)],
+        'date_placed': numpy.concatenate([date_placed.values, upgrade_date_placed.values]),
+        'total_excl_tax': 49.0,
+        'mode': ['honor'] * pairs + ['verified'] * len(upgraded),
+        'course_id': numpy.concatenate([course_ids, course_ids[upgraded]]),
+    })
+
+    orders = orders.sort_values(['username', 'course_id', 'date_placed'], kind='mergesort')
+    return orders.reset_index(drop=True)
+
+
+def legacy_remove_upgraded_orders(orders):
+    """ The original, per-group implementation, ported to the current pandas API. """
+    for __, row_ids in orders.groupby(['username', 'course_id']).groups.items():
+        if len(row_ids) > 1:
+            orders = orders.drop(sorted(row_ids)[0])
+    return orders
+
+
+def measure(function, orders, repeat):
+    return min(timeit.repeat(lambda: function(orders), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the removal of upgraded orders.')
+    parser.add_argument('--orders', type=int, default=1000000, help='Number of synthetic orders.')
+    parser.add_argument('--legacy-orders', type=int, default=20000,
+                        help='Number of synthetic orders used for the legacy implementation.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times each measurement is repeated.')
+    args = parser.parse_args()
+
+    # Silence the per-call log output of the audit module.
+    logging.getLogger('order_fulfillment').setLevel(logging.WARNING)
+
+    sample = build_orders(args.legacy_orders)
+    expected = legacy_remove_upgraded_orders(sample)
+    actual = remove_upgraded_orders(sample)
+    assert sorted(expected.number) == sorted(actual.number), 'Implementations disagree on the sample.'
+
+    legacy = measure(legacy_remove_upgraded_orders, sample, args.repeat)
+    vectorized_sample = measure(remove_upgraded_orders, sample, args.repeat)
+    print('{:>10} orders: legacy {:8.3f}s, vectorized {:8.3f}s'.format(len(sample), legacy, vectorized_sample))
+
+    orders = build_orders(args.orders)
+    vectorized = measure(remove_upgraded_orders, orders, args.repeat)
+    print('{:>10} orders: vectorized {:8.3f}s'.format(len(orders), vectorized))
+
+
+if __name__ == '__main__':
+    main()
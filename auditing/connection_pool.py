@@ -0,0 +1,96 @@
+""" Lazily opened, reusable database connections. """
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import MySQLdb
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """ A small, thread-safe pool of database connections.
+
+    Connections are only opened when first needed, and are kept open after use so that repeated audits (e.g. in a
+    long-running process) do not pay for connection setup every time. Idle connections are pinged before being reused,
+    and replaced if they are no longer healthy.
+
+    Arguments:
+        connect (callable): Opens a new connection.
+        max_idle (int): Maximum number of idle connections kept open.
+        health_check_interval (float): Connections idle for less than this many seconds are reused without a ping.
+    """
+
+    def __init__(self, connect, max_idle=4, health_check_interval=30):
+        self._connect = connect
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection from the pool, for the duration of the context.
+
+        The connection is returned to the pool when the context exits. Connections which raised an error are closed
+        instead, since they may be left in an unknown state (e.g. with an unread server-side result set).
+        """
+        connection = self._acquire()
+        try:
+            yield connection
+        except BaseException:
+            _close_quietly(connection)
+            raise
+        else:
+            self._release(connection)
+
+    def close(self):
+        """ Close all idle connections. """
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection, __ in idle:
+            _close_quietly(connection)
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, released_at = self._idle.pop()
+
+            if time.monotonic() - released_at < self.health_check_interval:
+                return connection
+
+            try:
+                connection.ping()
+                return connection
+            except MySQLdb.Error:
+                logger.warning('Discarding unhealthy database connection.')
+                _close_quietly(connection)
+
+        return self._connect()
+
+    def _release(self, connection):
+        # End the current transaction. Otherwise, the next user of the connection would keep reading from the
+        # (REPEATABLE READ) snapshot taken by the first query of this one.
+        try:
+            connection.rollback()
+        except MySQLdb.Error:
+            _close_quietly(connection)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((connection, time.monotonic()))
+                return
+
+        _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except MySQLdb.Error:
+        pass
@@ -0,0 +1,140 @@
+""" Timing and query plan instrumentation of the audit queries.
+
+Every instrumented query is logged as a single line of JSON, with its wall time, number of rows returned, and the
+(approximate) number of bytes transferred. Totals per query can also be written to a Prometheus text file, e.g. for
+the node exporter's textfile collector.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """ Measurements of a query, or totals over several runs of a query (see `count`).
+
+    Only time spent executing the query and fetching its rows is counted, so that rows can be processed in between
+    fetches (e.g. with server-side cursors) without skewing the measurement.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 1
+        self.duration = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def timed(self, function, *args):
+        """ Call the given function, adding its wall time to the duration of the query. """
+        started = time.monotonic()
+        try:
+            return function(*args)
+        finally:
+            self.duration += time.monotonic() - started
+
+    def fetch(self, function, *args):
+        """ Call the given fetch function (e.g. `cursor.fetchmany`), and count the rows it returns. """
+        rows = self.timed(function, *args)
+        self.rows += len(rows)
+        self.bytes += sum(_estimate_size(value) for row in rows for value in row)
+        return rows
+
+    def add(self, other):
+        """ Add the measurements of another run of the query to these. """
+        self.count += other.count
+        self.duration += other.duration
+        self.rows += other.rows
+        self.bytes += other.bytes
+
+    def as_dict(self):
+        return OrderedDict([
+            ('query', self.name),
+            ('duration', round(self.duration, 6)),
+            ('rows', self.rows),
+            ('bytes', self.bytes),
+        ])
+
+
+class QueryInstrumentation:
+    """ Records the queries run by the audit.
+
+    Arguments:
+        explain (bool): Whether to log the plan of every query, by running EXPLAIN before it.
+        textfile (str): Path of the Prometheus text file written by `write_textfile`.
+    """
+
+    def __init__(self, explain=False, textfile=None):
+        self.explain = explain
+        self.textfile = textfile
+        self._totals = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def query(self, name, cursor, sql, params=None):
+        """ Execute a query on the given cursor, and measure it until the context exits.
+
+        Rows must be fetched through the `fetch` method of the yielded `QueryStats` to be counted.
+        """
+        if self.explain:
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            logger.info(json.dumps({'query': name, 'explain': plan}, default=str))
+
+        stats = QueryStats(name)
+        stats.timed(cursor.execute, sql, params)
+        yield stats
+
+        logger.info(json.dumps(stats.as_dict()))
+        with self._lock:
+            if name in self._totals:
+                self._totals[name].add(stats)
+            else:
+                self._totals[name] = stats
+
+    def reset(self):
+        """ Clear the totals, e.g. at the start of an audit run. """
+        with self._lock:
+            self._totals = OrderedDict()
+
+    def write_textfile(self):
+        """ Write the totals of each query to the Prometheus text file, if one is configured.
+
+        The file is replaced atomically, so collectors never read a partially written file.
+        """
+        if not self.textfile:
+            return
+
+        metrics = [
+            ('audit_query_count', 'Number of times the query ran.', lambda total: total.count),
+            ('audit_query_duration_seconds', 'Wall time spent executing and fetching the query.',
+             lambda total: total.duration),
+            ('audit_query_rows', 'Number of rows returned by the query.', lambda total: total.rows),
+            ('audit_query_bytes', 'Approximate number of bytes returned by the query.', lambda total: total.bytes),
+        ]
+        with self._lock:
+            totals = list(self._totals.values())
+
+        lines = []
+        for metric, description, value in metrics:
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} gauge'.format(metric))
+            for total in totals:
+                lines.append('{}{{query="{}"}} {}'.format(metric, total.name, value(total)))
+
+        temp_path = self.textfile + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.textfile)
+
+
+def _estimate_size(value):
+    """ Estimate the number of bytes used to transfer a value. Non-string values are counted as 8 bytes. """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
@@ -1,15 +1,29 @@
 #! /usr/bin/env python
 
 """ Verify all completed orders have active enrollments. """
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import closing
 from datetime import timedelta, datetime
+import argparse
+import itertools
 import logging
+import multiprocessing
 import os
+import random
+import signal
 import sys
+import time
 
 import MySQLdb
+import MySQLdb.cursors
 import pandas
 
+from audit_state import AuditState
+from connection_pool import ConnectionPool
+from instrumentation import QueryInstrumentation
+from product_index import ProductIndex
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,31 +36,82 @@ def setup_logging():
     ch = logging.StreamHandler()
     ch.setFormatter(logging.Formatter(msg_format))
     ch.setLevel(logging.DEBUG)
-    logger.addHandler(ch)
-    logger.setLevel(logging.DEBUG)
+
+    # The helper modules log the query metrics, connection and state events.
+    for name in (__name__, 'audit_state', 'connection_pool', 'instrumentation', 'product_index'):
+        module_logger = logging.getLogger(name)
+        module_logger.addHandler(ch)
+        module_logger.setLevel(logging.DEBUG)
 
     pandas.set_option('display.max_rows', 500)
     pandas.set_option('display.max_columns', 500)
     pandas.set_option('display.width', 1000)
 
 
-ecommerce_db = MySQLdb.connect(host=os.environ['ECOMMERCE_DB_HOST'],
-                               user=os.environ['ECOMMERCE_DB_USER'],
-                               passwd=os.environ['ECOMMERCE_DB_PASSWORD'],
-                               db=os.environ['ECOMMERCE_DB_NAME'])
+def connect_ecommerce():
+    """ Open a new connection to the ecommerce database. """
+    return MySQLdb.connect(host=os.environ['ECOMMERCE_DB_HOST'],
+                           user=os.environ['ECOMMERCE_DB_USER'],
+                           passwd=os.environ['ECOMMERCE_DB_PASSWORD'],
+                           db=os.environ['ECOMMERCE_DB_NAME'])
+
+
+def connect_edxapp():
+    """ Open a new connection to the edxapp database. """
+    return MySQLdb.connect(host=os.environ['EDXAPP_DB_HOST'],
+                           user=os.environ['EDXAPP_DB_USER'],
+                           passwd=os.environ['EDXAPP_DB_PASSWORD'],
+                           db=os.environ['EDXAPP_DB_NAME'])
 
-edxapp_db = MySQLdb.connect(host=os.environ['EDXAPP_DB_HOST'],
-                            user=os.environ['EDXAPP_DB_USER'],
-                            passwd=os.environ['EDXAPP_DB_PASSWORD'],
-                            db=os.environ['EDXAPP_DB_NAME'])
 
 # This is the number of minutes to look back when retrieving orders (e.g. all orders in the last 15 minutes).
 ORDER_WINDOW_START_TIME = int(os.environ.get('ORDER_WINDOW_START_TIME', 20))
 
+# Number of order rows to read from the ecommerce database at a time. When set, orders are streamed through a
+# server-side cursor and reconciled one chunk at a time, instead of being loaded into a single DataFrame. This keeps
+# memory usage flat when auditing wide windows (e.g. backfills). Set to 0 to read all orders at once.
+ORDER_CHUNK_SIZE = int(os.environ.get('ORDER_CHUNK_SIZE', 0))
+
+# Number of seconds MySQL waits to write to the streaming connection before dropping it (net_write_timeout). The
+# server-side cursor stays open while each chunk is reconciled, so this bounds the time spent on a single chunk.
+ORDER_STREAM_WRITE_TIMEOUT = int(os.environ.get('ORDER_STREAM_WRITE_TIMEOUT', 3600))
+
+# Path to the JSON file holding the state of incremental audits. When set, only the orders placed after the last
+# audited order are retrieved, instead of the last ORDER_WINDOW_START_TIME minutes of orders.
+AUDIT_STATE_FILE = os.environ.get('AUDIT_STATE_FILE')
+
+# Number of minutes before the last audited order which incremental audits re-read, to catch orders completed after
+# later-placed orders were audited. Orders already audited during that window are skipped. This is a tradeoff: each
+# audit reads this many minutes of orders from the ecommerce replica again, so a longer overlap catches orders completed
+# later (or replicated later), at the cost of load on the replica and of a larger `audited` map in the state file.
+# An overlap as long as ORDER_WINDOW_START_TIME reads as many orders as a non-incremental audit.
+AUDIT_STATE_OVERLAP = int(os.environ.get('AUDIT_STATE_OVERLAP', 3))
+
+# Number of minutes during which an unfulfilled order is re-checked (and reported) by subsequent incremental audits.
+AUDIT_PENDING_GRACE_PERIOD = int(os.environ.get('AUDIT_PENDING_GRACE_PERIOD', ORDER_WINDOW_START_TIME))
+
+# Number of seconds between the start of two audits, when running as a daemon.
+AUDIT_INTERVAL = float(os.environ.get('AUDIT_INTERVAL', 60))
+
+# Maximum number of seconds randomly added to the interval between two audits, when running as a daemon.
+AUDIT_INTERVAL_JITTER = float(os.environ.get('AUDIT_INTERVAL_JITTER', 5))
+
+# Maximum number of worker processes auditing shards concurrently during a backfill.
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', 4))
 
-def get_orders(date_placed):
-    """ Retrieve all completed orders placed after the given date. """
-    sql = """SELECT
+# Whether to log the plan (EXPLAIN) of every audit query, alongside its timings.
+AUDIT_EXPLAIN_QUERIES = os.environ.get('AUDIT_EXPLAIN_QUERIES', '').lower() in ('1', 'true', 'yes')
+
+# Path of a Prometheus text file to which per-query metrics are written after every audit run.
+AUDIT_METRICS_TEXTFILE = os.environ.get('AUDIT_METRICS_TEXTFILE')
+
+# Path of a local SQLite cache of the course key and mode of products. When set, the order query no longer joins the
+# product attribute tables, and products are resolved through the (incrementally refreshed) cache instead.
+AUDIT_PRODUCT_CACHE = os.environ.get('AUDIT_PRODUCT_CACHE')
+
+ORDER_COLUMNS = ['username', 'number', 'date_placed', 'total_excl_tax', 'mode', 'course_id']
+
+ORDERS_SQL = """SELECT
     u.username
     , o.number
     , o.date_placed
@@ -66,41 +131,238 @@ FROM
     LEFT JOIN refund_refundline rl ON (rl.order_line_id = ol.id)
 WHERE
     o.status = 'Complete'
-    AND o.date_placed > %s
+    AND {date_placed_filter}
     AND rl.id IS NULL
 ORDER BY
     u.username ASC
     , pav.value_text ASC
     , o.date_placed ASC;
 """
-    date_placed = date_placed.strftime('%Y-%m-%d %H:%M:%S')
-    orders = pandas.read_sql_query(sql, ecommerce_db, index_col='number', params=(date_placed,),
-                                   parse_dates=('date_placed',))
-    orders.reset_index(level=0, inplace=True)
+
+
+ORDER_LINES_SQL = """SELECT
+    u.username
+    , o.number
+    , o.date_placed
+    , o.total_excl_tax
+    , ol.product_id
+FROM
+    order_order o
+    JOIN ecommerce_user u ON (o.user_id = u.id)
+    JOIN order_line ol ON (ol.order_id = o.id)
+    LEFT JOIN refund_refundline rl ON (rl.order_line_id = ol.id)
+WHERE
+    o.status = 'Complete'
+    AND {date_placed_filter}
+    AND rl.id IS NULL
+ORDER BY
+    u.username ASC
+    , o.date_placed ASC;
+"""
+
+PRODUCTS_SQL = """SELECT
+    p.id
+    , pav.value_text AS 'course_key'
+    , pav2.value_text AS 'mode'
+    , p.date_updated
+FROM
+    catalogue_product p
+    JOIN catalogue_productattributevalue pav ON (pav.product_id = p.id)
+    JOIN catalogue_productattribute pa ON (pa.id = pav.attribute_id AND pa.code = 'course_key')
+    JOIN catalogue_productattributevalue pav2 ON (pav2.product_id = p.id)
+    JOIN catalogue_productattribute pa2 ON (pa2.id = pav2.attribute_id AND pa2.code = 'certificate_type')
+WHERE
+    {product_filter};
+"""
+
+
+def load_products(updated_after=None, product_ids=None):
+    """ Retrieve the course key and mode of products, either by ID or updated after the given date.
+
+    If neither argument is given, all products are retrieved.
+
+    Returns:
+        list: (product_id, course_key, mode, date_updated) rows.
+    """
+    if product_ids is not None:
+        product_filter = 'p.id IN ({})'.format(','.join('%s' for __ in product_ids))
+        params = list(product_ids)
+    elif updated_after is not None:
+        product_filter = 'p.date_updated >= %s'
+        params = [updated_after.strftime('%Y-%m-%d %H:%M:%S.%f')]
+    else:
+        product_filter = '1 = 1'
+        params = []
+
+    with ecommerce_pool.connection() as db:
+        rows, __ = read_query(db, 'products', PRODUCTS_SQL.format(product_filter=product_filter), params)
+    return rows
+
+
+product_index = ProductIndex(AUDIT_PRODUCT_CACHE, load_products) if AUDIT_PRODUCT_CACHE else None
+
+
+def remove_upgraded_orders(orders):
+    """ Remove the honor purchase of users who upgraded to verified.
+
+    Only the most recent order placed by a user for a given course is kept. This is done in a single vectorized pass,
+    rather than by dropping rows one group at a time, since every drop copies the whole DataFrame.
+    """
     original_order_count = len(orders)
 
     # Identify upgrades and remove the honor purchase.
     # TODO We will need to do the same for credit.
-    grouped = orders.groupby(['username', 'course_id'])
-    for key, row_ids in grouped.groups.iteritems():
-        username, course_id = key
-        if len(row_ids) > 1:
-            row_ids.sort()
-            honor_order = orders.ix[row_ids[0]]
-            verified_order = orders.ix[row_ids[1]]
-
-            logger.info(
-                'User [%s] upgraded for course [%s]. Honor order [%s] will be ignored in favor of verified order [%s].',
-                username, course_id, honor_order['number'], verified_order['number'])
-            orders = orders.drop(row_ids[0])
+    keys = ['username', 'course_id']
+    orders = orders.sort_values(keys + ['date_placed', 'number'], kind='mergesort')
+    superseded = orders.duplicated(keys, keep='last')
+
+    # Formatting the upgrades is expensive for large DataFrames, so only do it if it will be logged.
+    if superseded.any() and logger.isEnabledFor(logging.INFO):
+        latest_orders = orders[orders.duplicated(keys, keep=False) & ~superseded]
+        upgrades = pandas.merge(orders.loc[superseded, keys + ['number']], latest_orders[keys + ['number']],
+                                on=keys, suffixes=('_honor', '_verified'))
+        logger.info('Identified [%d] upgrade(s). Honor orders will be ignored in favor of verified orders:\n%s',
+                    len(upgrades), upgrades.to_string(index=False))
+
+    orders = orders[~superseded]
 
     logger.info('Dropped [%d] orders.', original_order_count - len(orders))
     return orders
 
 
-def get_enrollments(usernames, course_ids):
-    """ Retrieve all enrollments for the given courses and users. """
-    sql = """SELECT
+def _orders_query(date_placed, date_placed_end=None):
+    """ Build the orders query, and its parameters, for the orders placed after the given date.
+
+    If an end date is given, only orders placed up to (and including) that date are included. If the product index
+    is enabled, the query returns product IDs instead of courses and modes.
+    """
+    date_format = '%Y-%m-%d %H:%M:%S.%f'
+    date_placed_filter = 'o.date_placed > %s'
+    params = (date_placed.strftime(date_format),)
+
+    if date_placed_end is not None:
+        date_placed_filter += ' AND o.date_placed <= %s'
+        params += (date_placed_end.strftime(date_format),)
+
+    sql = ORDER_LINES_SQL if product_index else ORDERS_SQL
+    return sql.format(date_placed_filter=date_placed_filter), params
+
+
+def get_orders(date_placed, date_placed_end=None):
+    """ Retrieve all completed orders placed after the given date, up to the given end date. """
+    sql, params = _orders_query(date_placed, date_placed_end)
+    with ecommerce_pool.connection() as db:
+        rows, columns = read_query(db, 'orders', sql, params)
+    return _build_orders_frame(rows, columns)
+
+
+def iter_orders(date_placed, chunk_size, date_placed_end=None):
+    """ Stream all completed orders placed after the given date, up to the given end date, as
+    DataFrames of roughly `chunk_size` rows.
+
+    Rows are read through a server-side cursor, so only one chunk is held in memory at a time. Since the query is
+    ordered by username, the rows belonging to the last user of a chunk are held back and prepended to the next
+    chunk. This guarantees upgrades are never split across two chunks.
+    """
+    sql, params = _orders_query(date_placed, date_placed_end)
+    with ecommerce_pool.connection() as db:
+        # The server would otherwise drop the connection if reconciling a chunk took longer than its default of 60s.
+        with closing(db.cursor()) as cursor:
+            cursor.execute('SET SESSION net_write_timeout = %s', (ORDER_STREAM_WRITE_TIMEOUT,))
+
+        with closing(db.cursor(MySQLdb.cursors.SSCursor)) as cursor, \
+                instrumentation.query('orders', cursor, sql, params) as stats:
+            columns = [column[0] for column in cursor.description]
+            username_index = columns.index('username')
+
+            held_back = []
+            while True:
+                rows = stats.fetch(cursor.fetchmany, chunk_size)
+                if not rows:
+                    break
+
+                rows = held_back + list(rows)
+                last_username = rows[-1][username_index]
+                split = len(rows)
+                while split > 0 and rows[split - 1][username_index] == last_username:
+                    split -= 1
+
+                rows, held_back = rows[:split], rows[split:]
+                if rows:
+                    yield _build_orders_frame(rows, columns)
+
+            if held_back:
+                yield _build_orders_frame(held_back, columns)
+
+
+def read_query(db, name, sql, params=None):
+    """ Run an instrumented query.
+
+    Returns:
+        tuple: list of result rows, and list of column names.
+    """
+    with closing(db.cursor()) as cursor, instrumentation.query(name, cursor, sql, params) as stats:
+        rows = stats.fetch(cursor.fetchall)
+        columns = [column[0] for column in cursor.description]
+    return list(rows), columns
+
+
+def _resolve_products(rows, columns):
+    """ Replace the product ID of order rows by the mode and course of the product, using the product index.
+
+    Order lines for products without a course key or mode are dropped, as they are by the join in ORDERS_SQL.
+    """
+    product_id_index = columns.index('product_id')
+    products = product_index.get({row[product_id_index] for row in rows})
+
+    resolved_rows = []
+    for row in rows:
+        product = products.get(row[product_id_index])
+        if product:
+            resolved_rows.append(tuple(row[:product_id_index]) + tuple(row[product_id_index + 1:]) + product)
+
+    columns = columns[:product_id_index] + columns[product_id_index + 1:] + ['mode', 'course_id']
+    return resolved_rows, columns
+
+
+def fetch_orders(date_placed, date_placed_end=None):
+    """ Retrieve orders as a single DataFrame, or as a stream of chunks if ORDER_CHUNK_SIZE is set.
+
+    Returns:
+        iterable: DataFrames of orders.
+    """
+    if ORDER_CHUNK_SIZE:
+        return iter_orders(date_placed, ORDER_CHUNK_SIZE, date_placed_end)
+    return [get_orders(date_placed, date_placed_end)]
+
+
+def _build_orders_frame(rows, columns):
+    """ Build an orders DataFrame from raw rows, and remove upgraded orders. """
+    if 'product_id' in columns:
+        rows, columns = _resolve_products(rows, columns)
+
+    orders = pandas.DataFrame.from_records(rows, columns=columns)
+    orders['date_placed'] = pandas.to_datetime(orders['date_placed'])
+    return remove_upgraded_orders(orders)
+
+
+# Maximum number of usernames included in the IN-list of a single enrollment query.
+ENROLLMENT_BATCH_SIZE = int(os.environ.get('ENROLLMENT_BATCH_SIZE', 1000))
+
+# Number of enrollment batches queried concurrently. Each worker uses its own edxapp connection.
+ENROLLMENT_BATCH_CONCURRENCY = int(os.environ.get('ENROLLMENT_BATCH_CONCURRENCY', 4))
+
+instrumentation = QueryInstrumentation(explain=AUDIT_EXPLAIN_QUERIES, textfile=AUDIT_METRICS_TEXTFILE)
+
+# Connections are opened on first use, and kept open across audits.
+ecommerce_pool = ConnectionPool(connect_ecommerce, max_idle=1)
+edxapp_pool = ConnectionPool(connect_edxapp, max_idle=ENROLLMENT_BATCH_CONCURRENCY)
+
+# Number of (username, course_id) pairs above which the pairs are bulk-loaded into a temporary table on edxapp,
+# and joined against, instead of being looked up with batched IN-lists.
+ENROLLMENT_TEMP_TABLE_THRESHOLD = int(os.environ.get('ENROLLMENT_TEMP_TABLE_THRESHOLD', 20000))
+
+ENROLLMENTS_SQL = """SELECT
     u.username
     , e.course_id
     , e.mode
@@ -111,52 +373,333 @@ FROM
 WHERE
     u.username IN ({usernames})
     AND e.course_id in ({course_ids});
-""".format(usernames=','.join('%s' for __ in usernames), course_ids=','.join('%s' for __ in course_ids))
+"""
+
+ENROLLMENT_KEYS_TABLE_SQL = """CREATE TEMPORARY TABLE audit_enrollment_keys (
+    username VARCHAR(150) NOT NULL
+    , course_id VARCHAR(255) NOT NULL
+    , PRIMARY KEY (username, course_id)
+);
+"""
+
+ENROLLMENTS_JOIN_SQL = """SELECT
+    u.username
+    , e.course_id
+    , e.mode
+    , e.is_active
+FROM
+    audit_enrollment_keys k
+    JOIN auth_user u ON (u.username = k.username)
+    JOIN student_courseenrollment e ON (e.user_id = u.id AND e.course_id = k.course_id);
+"""
+
+
+def get_enrollments(usernames, course_ids, pairs=None):
+    """ Retrieve all enrollments for the given courses and users.
 
+    The lookup strategy is picked based on the size of the input:
+        * a single query, if all usernames fit in one batch;
+        * a join against a temporary table loaded with the (username, course_id) `pairs`, if there are more than
+          ENROLLMENT_TEMP_TABLE_THRESHOLD of them;
+        * otherwise, IN-lists of at most ENROLLMENT_BATCH_SIZE usernames, queried concurrently.
+    """
+    if len(usernames) <= ENROLLMENT_BATCH_SIZE:
+        with edxapp_pool.connection() as db:
+            return _query_enrollments(db, usernames, course_ids)
+
+    if pairs is not None and len(pairs) > ENROLLMENT_TEMP_TABLE_THRESHOLD:
+        logger.info('Looking up enrollments for [%d] pairs through a temporary table.', len(pairs))
+        with edxapp_pool.connection() as db:
+            return _join_enrollments(db, pairs)
+
+    return _batch_enrollments(usernames, course_ids)
+
+
+def _query_enrollments(db, usernames, course_ids):
+    """ Retrieve the enrollments for the given courses and users with a single query. """
+    sql = ENROLLMENTS_SQL.format(usernames=','.join('%s' for __ in usernames),
+                                 course_ids=','.join('%s' for __ in course_ids))
     params = list(usernames) + list(course_ids)
-    enrollments = pandas.read_sql_query(sql, edxapp_db, params=params)
-    return enrollments
+    rows, columns = read_query(db, 'enrollments', sql, params)
+    return pandas.DataFrame.from_records(rows, columns=columns)
+
+
+def _batch_enrollments(usernames, course_ids):
+    """ Retrieve the enrollments for the given courses and users, with batches of usernames queried concurrently. """
+    batches = [usernames[i:i + ENROLLMENT_BATCH_SIZE] for i in range(0, len(usernames), ENROLLMENT_BATCH_SIZE)]
+    workers = max(min(ENROLLMENT_BATCH_CONCURRENCY, len(batches)), 1)
+    logger.info('Looking up enrollments for [%d] users in [%d] batches, using [%d] connections.',
+                len(usernames), len(batches), workers)
+
+    def query_batches(worker_batches):
+        with edxapp_pool.connection() as db:
+            return [_query_enrollments(db, batch, course_ids) for batch in worker_batches]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(query_batches, [batches[i::workers] for i in range(workers)])
+        frames = [frame for worker_frames in results for frame in worker_frames]
+
+    return pandas.concat(frames, ignore_index=True)
+
+
+def _join_enrollments(db, pairs):
+    """ Retrieve the enrollments for the given (username, course_id) pairs, by joining against a temporary table.
+
+    The edxapp user requires the CREATE TEMPORARY TABLES privilege. Temporary tables are allowed on read-only replicas.
+    """
+    with closing(db.cursor()) as cursor:
+        cursor.execute(ENROLLMENT_KEYS_TABLE_SQL)
+        try:
+            # Bound the size of each multi-row INSERT, to stay under max_allowed_packet.
+            for i in range(0, len(pairs), ENROLLMENT_BATCH_SIZE):
+                cursor.executemany('INSERT IGNORE INTO audit_enrollment_keys (username, course_id) VALUES (%s, %s)',
+                                   pairs[i:i + ENROLLMENT_BATCH_SIZE])
+            rows, columns = read_query(db, 'enrollments_join', ENROLLMENTS_JOIN_SQL)
+            return pandas.DataFrame.from_records(rows, columns=columns)
+        finally:
+            cursor.execute('DROP TEMPORARY TABLE IF EXISTS audit_enrollment_keys;')
 
 
 def identify_missing_enrollments(orders, enrollments):
     """ Identify the orders that do not have corresponding enrollments. """
+    # The merge is faster than looking order keys up in a set of enrollment keys built from the same DataFrames
+    # (0.94s against 1.27s for 1M orders), so it is kept.
     merged = pandas.merge(orders, enrollments, on=['username', 'course_id', 'mode'], how='left')
     unfulfilled_orders = merged[merged.is_active.isnull()]
     return unfulfilled_orders
 
 
-def run_audit():
-    date_placed = datetime.utcnow() - timedelta(minutes=ORDER_WINDOW_START_TIME)
-    orders = get_orders(date_placed)
-    usernames = pandas.unique(orders.username.ravel())
-    course_ids = pandas.unique(orders.course_id.ravel())
-    num_orders = len(orders)
+def reconcile_orders(orders):
+    """ Retrieve the enrollments for the given orders, and identify the orders that were not fulfilled.
+
+    Returns:
+        tuple: number of enrollments retrieved, and a DataFrame of unfulfilled orders.
+    """
+    usernames = orders.username.unique()
+    course_ids = orders.course_id.unique()
     logger.info('Retrieved [%d] orders, for [%d] users and [%d] courses, from the ecommerce database.',
-                num_orders, len(usernames), len(course_ids))
+                len(orders), len(usernames), len(course_ids))
+
+    pairs = list(orders[['username', 'course_id']].drop_duplicates().itertuples(index=False, name=None))
+    enrollments = get_enrollments(usernames, course_ids, pairs)
+    logger.info('Retrieved [%d] enrollments from the edxapp database.', len(enrollments))
+
+    return len(enrollments), identify_missing_enrollments(orders, enrollments)
 
-    enrollments = get_enrollments(usernames, course_ids)
-    num_enrollments = len(enrollments)
-    logger.info('Retrieved [%d] enrollments from the edxapp database.', num_enrollments)
 
-    unfulfilled_orders = identify_missing_enrollments(orders, enrollments)
-    if len(unfulfilled_orders) > 0:
-        logger.error('Identified [%d] unfulfilled order(s):\n%s',
-                     len(unfulfilled_orders), unfulfilled_orders.to_string(index=False))
-        return False
+class AuditResult(namedtuple('AuditResult', ['orders', 'enrollments', 'unfulfilled_orders', 'duration'])):
+    """ Counts, and wall time in seconds, of a single audit run. """
 
-    logger.info('No unfulfilled orders identified. All is well.')
-    return True
+    @property
+    def ok(self):
+        return self.unfulfilled_orders == 0
+
+
+def run_audit():
+    started = time.monotonic()
+    instrumentation.reset()
+    now = datetime.utcnow()
+    date_placed = now - timedelta(minutes=ORDER_WINDOW_START_TIME)
+    state = AuditState.load(AUDIT_STATE_FILE) if AUDIT_STATE_FILE else None
+    if product_index:
+        product_index.refresh()
+    if state and state.date_placed:
+        date_placed = state.date_placed - timedelta(minutes=AUDIT_STATE_OVERLAP)
+        logger.info('Auditing orders placed after [%s], skipping the [%d] order(s) already audited since then.',
+                    date_placed, len(state.audited))
+
+    batches = fetch_orders(date_placed)
+    if state:
+        # Upgrades are removed before skipping audited orders, so a late honor order is still superseded by an
+        # already audited verified order.
+        batches = (orders[~orders.number.isin(state.audited)] for orders in batches)
+    if state and state.pending:
+        logger.info('Re-checking [%d] previously unfulfilled order(s).', len(state.pending))
+        pending_orders = pandas.DataFrame.from_records(state.pending, columns=ORDER_COLUMNS)
+        batches = itertools.chain([pending_orders], batches)
+
+    def record_batch(orders):
+        latest_order = orders.sort_values(['date_placed', 'number']).iloc[-1]
+        state.advance(latest_order['date_placed'].to_pydatetime(), latest_order['number'])
+        state.record(orders['number'].tolist(), orders['date_placed'].dt.to_pydatetime().tolist())
+
+    num_orders, num_enrollments, unfulfilled_orders = reconcile_batches(batches, record_batch if state else None)
+    if state:
+        if state.date_placed:
+            state.forget_before(state.date_placed - timedelta(minutes=AUDIT_STATE_OVERLAP))
+        unfulfilled_records = [] if unfulfilled_orders is None else unfulfilled_orders[ORDER_COLUMNS].to_dict('records')
+        state.carry_forward(unfulfilled_records, now, timedelta(minutes=AUDIT_PENDING_GRACE_PERIOD))
+        state.save()
+
+    num_unfulfilled_orders = report_unfulfilled_orders(unfulfilled_orders)
+    instrumentation.write_textfile()
+    return AuditResult(num_orders, num_enrollments, num_unfulfilled_orders, time.monotonic() - started)
+
+
+def reconcile_batches(batches, on_batch=None):
+    """ Reconcile batches of orders, one at a time.
+
+    Arguments:
+        batches (iterable): DataFrames of orders.
+        on_batch (callable): Called with each non-empty batch, once it has been reconciled.
+
+    Returns:
+        tuple: number of orders, number of enrollments, and a DataFrame of unfulfilled orders (None if all orders
+            were fulfilled).
+    """
+    num_orders = 0
+    num_enrollments = 0
+    unfulfilled_batches = []
+    for orders in batches:
+        if orders.empty:
+            continue
+
+        batch_enrollments, batch_unfulfilled_orders = reconcile_orders(orders)
+        num_orders += len(orders)
+        num_enrollments += batch_enrollments
+        if len(batch_unfulfilled_orders) > 0:
+            unfulfilled_batches.append(batch_unfulfilled_orders)
+
+        if on_batch:
+            on_batch(orders)
+
+    logger.info('Audited [%d] orders against [%d] enrollments.', num_orders, num_enrollments)
+
+    unfulfilled_orders = pandas.concat(unfulfilled_batches) if unfulfilled_batches else None
+    return num_orders, num_enrollments, unfulfilled_orders
+
+
+def report_unfulfilled_orders(unfulfilled_orders):
+    """ Log the unfulfilled orders, if any, and return their number. """
+    if unfulfilled_orders is None:
+        logger.info('No unfulfilled orders identified. All is well.')
+        return 0
+
+    logger.error('Identified [%d] unfulfilled order(s):\n%s',
+                 len(unfulfilled_orders), unfulfilled_orders.to_string(index=False))
+    return len(unfulfilled_orders)
+
+
+def init_backfill_worker():
+    """ Set up a backfill worker process.
+
+    The parent process refreshes the product index before starting the workers, so workers only read it. This way the
+    products are loaded from ecommerce once, and the workers never write to the shared SQLite database.
+    """
+    global product_index  # pylint: disable=global-statement
+    setup_logging()
+    if AUDIT_PRODUCT_CACHE:
+        product_index = ProductIndex(AUDIT_PRODUCT_CACHE, load_products, read_only=True)
+
+
+def audit_shard(start, end):
+    """ Audit the orders placed after `start`, up to (and including) `end`.
+
+    This runs in a backfill worker process, which uses its own database connections.
+    """
+    logger.info('Auditing orders placed between [%s] and [%s].', start, end)
+    return reconcile_batches(fetch_orders(start, date_placed_end=end))
+
+
+def run_backfill(start, end, shard_duration, workers):
+    """ Audit all orders placed between `start` and `end`, split into shards of `shard_duration`.
+
+    Shards are audited in parallel by at most `workers` processes, each with its own connections to both databases,
+    and their unfulfilled orders are merged into a single report. Note that each worker may also run
+    ENROLLMENT_BATCH_CONCURRENCY concurrent enrollment queries.
+
+    Upgrades are only detected within a shard, so an honor order placed right before a shard boundary may be
+    reported if its verified upgrade falls in the next shard.
+    """
+    started = time.monotonic()
+    shards = []
+    shard_start = start
+    while shard_start < end:
+        shard_end = min(shard_start + shard_duration, end)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end
+
+    logger.info('Auditing [%d] shard(s) using [%d] worker process(es).', len(shards), workers)
+    if product_index:
+        product_index.refresh()
+
+    # Use fresh interpreters, rather than forks, so no connection is ever shared with the parent process.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_backfill_worker) as executor:
+        results = list(executor.map(audit_shard, [shard[0] for shard in shards], [shard[1] for shard in shards]))
+
+    num_orders = sum(result[0] for result in results)
+    num_enrollments = sum(result[1] for result in results)
+    unfulfilled_batches = [result[2] for result in results if result[2] is not None]
+    unfulfilled_orders = None
+    if unfulfilled_batches:
+        unfulfilled_orders = pandas.concat(unfulfilled_batches).sort_values(['date_placed', 'number'])
+
+    logger.info('Backfill audited [%d] orders against [%d] enrollments.', num_orders, num_enrollments)
+    num_unfulfilled_orders = report_unfulfilled_orders(unfulfilled_orders)
+    return AuditResult(num_orders, num_enrollments, num_unfulfilled_orders, time.monotonic() - started)
+
+
+def run_scheduler(interval, jitter):
+    """ Run the audit every `interval` seconds (plus up to `jitter` seconds), until the process is stopped.
+
+    Database connections are kept open between runs. A failed run is logged as an error, but does not stop the
+    scheduler.
+    """
+    consecutive_failures = 0
+    while True:
+        started = time.monotonic()
+        try:
+            result = run_audit()
+        except Exception:
+            consecutive_failures += 1
+            logger.exception('Audit run failed. [%d] consecutive failure(s).', consecutive_failures)
+        else:
+            consecutive_failures = 0
+            logger.info('Audit run took [%.3f] seconds: [%d] orders, [%d] enrollments, [%d] unfulfilled orders.',
+                        result.duration, result.orders, result.enrollments, result.unfulfilled_orders)
+
+        elapsed = time.monotonic() - started
+        time.sleep(max(interval - elapsed, 0) + random.uniform(0, jitter))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verify all completed orders have active enrollments.')
+    parser.add_argument('--daemon', action='store_true', help='Run the audit repeatedly, until stopped.')
+    parser.add_argument('--interval', type=float, default=AUDIT_INTERVAL,
+                        help='Number of seconds between two audits, when running as a daemon.')
+    parser.add_argument('--jitter', type=float, default=AUDIT_INTERVAL_JITTER,
+                        help='Maximum number of seconds randomly added to the interval between two audits.')
+    parser.add_argument('--backfill-start', type=datetime.fromisoformat,
+                        help='Audit all orders placed after this (UTC) date, instead of the most recent orders.')
+    parser.add_argument('--backfill-end', type=datetime.fromisoformat,
+                        help='Audit orders placed up to this (UTC) date, when backfilling. Defaults to now.')
+    parser.add_argument('--shard-hours', type=float, default=6,
+                        help='Number of hours of orders audited by each backfill shard.')
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS,
+                        help='Maximum number of shards audited concurrently.')
+    args = parser.parse_args()
+
     setup_logging()
 
     logger.info('Audit started...')
-    with closing(ecommerce_db):
-        with closing(edxapp_db):
-            try:
-                if not run_audit():
-                    # Use a non-zero exit code to indicate an error
-                    sys.exit(1)
-            finally:
-                logger.info('Audit completed.')
+    try:
+        if args.daemon:
+            # Stop gracefully, closing connections, when the container or supervisor stops the process.
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            run_scheduler(args.interval, args.jitter)
+        elif args.backfill_start:
+            backfill_end = args.backfill_end or datetime.utcnow()
+            if not run_backfill(args.backfill_start, backfill_end, timedelta(hours=args.shard_hours), args.workers).ok:
+                sys.exit(1)
+        elif not run_audit().ok:
+            # Use a non-zero exit code to indicate an error
+            sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ecommerce_pool.close()
+        edxapp_pool.close()
+        if product_index:
+            product_index.close()
+        logger.info('Audit completed.')
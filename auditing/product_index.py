@@ -0,0 +1,115 @@
+""" Local cache of the course key and certificate type (mode) of ecommerce products.
+
+Products rarely change, so rather than joining the product attribute tables in every order query, their course key
+and mode are kept in a local SQLite database. The cache is refreshed incrementally, based on the date products were
+last updated, and products referenced by orders but missing from the cache are loaded on demand.
+"""
+import logging
+import sqlite3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class ProductIndex:
+    """ Mapping of product IDs to their (mode, course_key), cached in a SQLite database.
+
+    Arguments:
+        path (str): Path of the SQLite database. It is created, and opened, on first use.
+        load_products (callable): Loads products from ecommerce. Called with either `updated_after` (a datetime, or
+            None to load all products) or `product_ids` as keyword argument, it returns rows of
+            (product_id, course_key, mode, date_updated).
+        read_only (bool): Open an existing database without ever writing to it, so that several processes can share
+            it. Such an index cannot be refreshed, and products missing from it are loaded without being stored.
+    """
+
+    def __init__(self, path, load_products, read_only=False):
+        self.path = path
+        self.load_products = load_products
+        self.read_only = read_only
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None and self.read_only:
+            self._db = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True)
+        elif self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS product (
+                    id INTEGER PRIMARY KEY,
+                    course_key TEXT,
+                    mode TEXT
+                );
+                CREATE TABLE IF NOT EXISTS refresh (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    date_updated TEXT NOT NULL
+                );
+            """)
+        return self._db
+
+    def refresh(self):
+        """ Load the products updated since the last refresh (or all products, on the first refresh). """
+        if self.read_only:
+            raise RuntimeError('The product index at [{}] is read-only.'.format(self.path))
+
+        row = self.db.execute('SELECT date_updated FROM refresh').fetchone()
+        updated_after = datetime.strptime(row[0], DATE_FORMAT) if row else None
+
+        products = self.load_products(updated_after=updated_after)
+        self._store(products)
+
+        latest = max((product[3] for product in products if product[3] is not None), default=None)
+        if latest is not None and (updated_after is None or latest > updated_after):
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO refresh (id, date_updated) VALUES (1, ?)',
+                                (latest.strftime(DATE_FORMAT),))
+
+        logger.info('Refreshed [%d] product(s) updated after [%s].', len(products), updated_after)
+
+    def get(self, product_ids):
+        """ Return the (mode, course_key) of the given products, keyed by product ID.
+
+        Products which are not in the cache are loaded from ecommerce. Products without a course key or mode (e.g.
+        coupons) are omitted from the result, and remembered as such so they are not loaded again.
+        """
+        product_ids = list(product_ids)
+        found = self._select(product_ids)
+
+        missing = [product_id for product_id in product_ids if product_id not in found]
+        if missing:
+            logger.info('Loading [%d] product(s) missing from the product index.', len(missing))
+            products = self.load_products(product_ids=missing)
+            if self.read_only:
+                found.update((product_id, (mode, course_key)) for product_id, course_key, mode, __ in products)
+            else:
+                loaded = {product[0] for product in products}
+                self._store(products + [(product_id, None, None, None) for product_id in missing
+                                        if product_id not in loaded])
+                found.update(self._select(missing))
+
+        return {product_id: product for product_id, product in found.items() if None not in product}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _select(self, product_ids):
+        found = {}
+        # Stay under SQLite's limit on the number of query parameters.
+        for i in range(0, len(product_ids), 500):
+            batch = product_ids[i:i + 500]
+            sql = 'SELECT id, mode, course_key FROM product WHERE id IN ({})'.format(','.join('?' for __ in batch))
+            for product_id, mode, course_key in self.db.execute(sql, batch):
+                found[product_id] = (mode, course_key)
+        return found
+
+    def _store(self, products):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO product (id, course_key, mode) VALUES (?, ?, ?)',
+                [(product_id, course_key, mode) for product_id, course_key, mode, __ in products]
+            )
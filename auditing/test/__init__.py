@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The audit modules import each other by name, since they are run as scripts from their directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
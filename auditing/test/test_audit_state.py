@@ -0,0 +1,62 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from testfixtures import TempDirectory
+
+from audit_state import AuditState
+
+
+class AuditStateTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TempDirectory()
+        self.path = os.path.join(self.temp_dir.path, 'state.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_missing_file_loads_blank_state(self):
+        state = AuditState.load(self.path)
+
+        self.assertIsNone(state.date_placed)
+        self.assertIsNone(state.number)
+        self.assertEqual(state.pending, [])
+        self.assertEqual(state.audited, {})
+
+    def test_save_load_round_trip(self):
+        date_placed = datetime(2020, 1, 2, 3, 4, 5, 678901)
+        pending = [{
+            'username': 'alice',
+            'number': 'EDX-100',
+            'date_placed': datetime(2020, 1, 2, 3, 0, 0),
+            'total_excl_tax': Decimal('49.00'),
+            'mode': 'verified',
+            'course_id': 'course-v1:edX+DemoX+Demo_Course',
+            'first_seen': datetime(2020, 1, 2, 3, 1, 0),
+        }]
+        audited = {'EDX-100': datetime(2020, 1, 2, 3, 0, 0), 'EDX-101': date_placed}
+        AuditState(self.path, date_placed, 'EDX-101', pending, audited).save()
+
+        state = AuditState.load(self.path)
+
+        self.assertEqual(state.date_placed, date_placed)
+        self.assertEqual(state.number, 'EDX-101')
+        self.assertEqual(state.pending, [dict(pending[0], total_excl_tax='49.00')])
+        self.assertEqual(state.audited, audited)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_advance_only_moves_forward(self):
+        state = AuditState(self.path)
+        state.advance(datetime(2020, 1, 2), 'EDX-2')
+        state.advance(datetime(2020, 1, 1), 'EDX-3')
+
+        self.assertEqual((state.date_placed, state.number), (datetime(2020, 1, 2), 'EDX-2'))
+
+    def test_forget_before(self):
+        state = AuditState(self.path)
+        state.record(['EDX-1', 'EDX-2'], [datetime(2020, 1, 1), datetime(2020, 1, 2)])
+        state.forget_before(datetime(2020, 1, 1) + timedelta(hours=1))
+
+        self.assertEqual(state.audited, {'EDX-2': datetime(2020, 1, 2)})
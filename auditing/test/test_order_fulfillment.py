@@ -0,0 +1,80 @@
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import order_fulfillment
+
+
+class FakeCursor:
+    """ Cursor returning the given rows, in the order of the query. """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.description = [(column,) for column in order_fulfillment.ORDER_COLUMNS]
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+def order(username, number, course_id='course-v1:edX+DemoX+Demo_Course', mode='verified'):
+    return (username, number, datetime(2020, 1, 1), Decimal('49.00'), mode, course_id)
+
+
+class IterOrdersTestCases(unittest.TestCase):
+
+    def iter_orders(self, rows, chunk_size):
+        settings_cursor = FakeCursor()
+        orders_cursor = FakeCursor(rows)
+        db = MagicMock()
+        db.cursor.side_effect = lambda *args: orders_cursor if args else settings_cursor
+
+        @contextmanager
+        def connection():
+            yield db
+
+        with patch.object(order_fulfillment.ecommerce_pool, 'connection', connection):
+            chunks = list(order_fulfillment.iter_orders(datetime(2020, 1, 1), chunk_size))
+        return chunks, settings_cursor
+
+    def test_usernames_are_not_split_across_chunks(self):
+        rows = [
+            order('alice', 'A1'),
+            order('bob', 'B1', course_id='course-v1:edX+B1+1T2020'),
+            order('bob', 'B2', course_id='course-v1:edX+B2+1T2020'),
+            order('bob', 'B3', course_id='course-v1:edX+B3+1T2020'),
+            order('carol', 'C1'),
+        ]
+        chunks, _ = self.iter_orders(rows, chunk_size=2)
+
+        self.assertEqual(
+            [sorted(chunk.number) for chunk in chunks],
+            [['A1'], ['B1', 'B2', 'B3'], ['C1']],
+        )
+
+    def test_upgrades_at_chunk_edges_are_removed(self):
+        rows = [
+            order('alice', 'A1'),
+            order('bob', 'B1', mode='honor'),
+            order('bob', 'B2', mode='verified'),
+        ]
+        chunks, _ = self.iter_orders(rows, chunk_size=2)
+
+        self.assertEqual(sorted(number for chunk in chunks for number in chunk.number), ['A1', 'B2'])
+
+    def test_write_timeout_is_raised(self):
+        _, settings_cursor = self.iter_orders([order('alice', 'A1')], chunk_size=2)
+
+        self.assertEqual(
+            settings_cursor.executed,
+            [('SET SESSION net_write_timeout = %s', (order_fulfillment.ORDER_STREAM_WRITE_TIMEOUT,))],
+        )
@@ -2,29 +2,250 @@ import argparse
 import csv
 import logging
 import os
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import islice
 
 from dateutil.parser import parse
 
-from services import CatalogApiService
+from services import CatalogApiService, UpdateResult
+
+# The progress journal and the worker pool are shared with the upgrade deadline repair script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'upgrade_deadlines'))
+import journal  # noqa: E402
+from worker_pool import run_bounded  # noqa: E402
+
+REPORTING_TYPES = {'mooc', 'spoc', 'test', 'demo', 'other'}
+
+# Course run keys, in the course-v1, ccx-v1 and deprecated Org/Course/Run formats.
+KEY_PART = r'[\w.\-~%:]+'
+COURSE_RUN_KEY = re.compile(
+    rf'course-v1:{KEY_PART}\+{KEY_PART}\+{KEY_PART}'
+    rf'|ccx-v1:{KEY_PART}\+{KEY_PART}\+{KEY_PART}\+ccx@\d+'
+    rf'|{KEY_PART}/{KEY_PART}/{KEY_PART}'
+)
+
+# Announcement dates are formatted as M/D/YY, or M/D/YYYY.
+ANNOUNCEMENT = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})')
+
+
+def parse_announcement(announcement):
+    """
+    Convert 2/1/16 or 2/1/2016 to 2016-02-01T00:00:00, falling back to dateutil for other formats.
+    """
+    match = ANNOUNCEMENT.fullmatch(announcement)
+    if not match:
+        return parse(announcement).isoformat()
+
+    month, day, year = (int(group) for group in match.groups())
+    if year < 100:
+        # Like dateutil, pick the year closest to today, within 50 years.
+        this_year = datetime.utcnow().year
+        year += this_year // 100 * 100
+        if year >= this_year + 50:
+            year -= 100
+        elif year < this_year - 50:
+            year += 100
+    return datetime(year, month, day).isoformat()
 
 
 def process_line(line):
+    """
+    Validate a CSV line, and return the key of its course run and the data to update it with.
+
+    Raises ValueError if the line is invalid.
+    """
+    key = line.get('course_run_key') or ''
+    if not COURSE_RUN_KEY.fullmatch(key):
+        raise ValueError(f'Invalid course run key {key!r}')
+
+    reporting_type = line.get('reporting_type')
+    if reporting_type not in REPORTING_TYPES:
+        raise ValueError(f'Invalid reporting type {reporting_type!r} for {key}')
+
     announcement = line.get('announcement')
     data = {
-        'reporting_type': line['reporting_type']
+        'reporting_type': reporting_type
     }
     if announcement:
-        # Convert 2/1/2016 to 2016-02-01T00:00:00+00:00
-        announcement = parse(announcement).isoformat()
-        data['announcement'] = announcement
-    return line['course_run_key'], data
+        try:
+            data['announcement'] = parse_announcement(announcement)
+        except (ValueError, OverflowError) as exc:
+            raise ValueError(f'Invalid announcement {announcement!r} for {key}') from exc
+    return key, data
+
+
+def read_rows(lines, tally, report=True):
+    """
+    Validate and de-duplicate CSV lines, yielding (line, key, data) rows.
+
+    Lines are read one at a time, and only the keys seen so far are kept in memory.
+    Invalid lines and lines repeating a key are skipped, counted in the tally, and
+    logged if `report` is set.
+    """
+    seen = set()
+    # Line 1 is the header.
+    for number, line in enumerate(lines, start=2):
+        try:
+            key, data = process_line(line)
+        except ValueError as exc:
+            if report:
+                logging.error('Line %d is invalid: %s', number, exc)
+            tally['invalid'] += 1
+            continue
+
+        if key in seen:
+            if report:
+                logging.warning('Line %d repeats course run [%s]. Skipping it.', number, key)
+            tally['duplicate'] += 1
+            continue
+
+        seen.add(key)
+        yield line, key, data
+
+
+def is_up_to_date(course_run, data):
+    """
+    Return whether a course run, as returned by the API, already has the values to set.
+    """
+    if course_run.get('reporting_type') != data['reporting_type']:
+        return False
+
+    if 'announcement' in data:
+        current = course_run.get('announcement')
+        if not current:
+            return False
+
+        # The API returns UTC datetimes, while the CSV has naive dates meant as UTC.
+        current, announcement = (parse(value) for value in (current, data['announcement']))
+        if announcement.tzinfo is None:
+            announcement = announcement.replace(tzinfo=timezone.utc)
+        if current.tzinfo is None:
+            current = current.replace(tzinfo=timezone.utc)
+        return current == announcement
+
+    return True
+
+
+def skip_up_to_date(rows, catalog_api_service, batch_size, tally):
+    """
+    Filter out the rows whose course runs already have the values to set.
+
+    Rows are read in batches, and the current values of each batch's course runs are
+    fetched with a single list call. Rows whose course runs could not be fetched are
+    kept, so they are written anyway. The number of rows skipped is added to the tally.
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+
+        keys = [key for __, key, __ in batch]
+        try:
+            current = {
+                course_run['key']: course_run
+                for course_run in catalog_api_service.get_course_runs(keys, page_size=batch_size)
+            }
+        except Exception:
+            logging.exception('Failed to fetch the current values of %d course runs. Updating all of them.', len(keys))
+            current = {}
+
+        for line, key, data in batch:
+            if key in current and is_up_to_date(current[key], data):
+                tally['up_to_date'] += 1
+            else:
+                yield line, key, data
+
 
 def update_course_run(key, data, catalog_api_service):
-    try:
-        catalog_api_service.update_course_run(key, data)
+    result = catalog_api_service.update_course_run(key, data)
+    if result.ok:
         logging.info(f'{key} update succeeded')
-    except:
-        logging.exception('Failed to update course run [%s]', key)
+    else:
+        logging.error('Failed to update course run [%s] with status [%s]: %s', key, result.status, result.error)
+    return result
+
+
+class ReplayFile:
+    """
+    CSV of the lines whose course runs failed to update, in the same format as the input,
+    so that a follow-up run only has to process those lines.
+
+    The file is only created when the first failure is recorded, and every line is flushed
+    as soon as it is written. A file left by a previous run is removed, so that it is never
+    mistaken for the failures of this run.
+    """
+    def __init__(self, path, fieldnames):
+        if os.path.exists(path):
+            os.remove(path)
+
+        self.path = path
+        self.fieldnames = fieldnames
+        self._file = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def write(self, line):
+        with self._lock:
+            if self._writer is None:
+                self._file = open(self.path, 'w', newline='')
+                self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames)
+                self._writer.writeheader()
+
+            self._writer.writerow(line)
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def update_course_runs(rows, catalog_api_service, workers, replay_file=None, progress_journal=None):
+    """
+    Update the course runs of the given (CSV line, key, data) rows using a pool of workers.
+
+    Rows are read as workers become available (see `run_bounded`), so the CSV is never read
+    into memory. Lines which failed to update are written to the replay file, if one is
+    given, and the outcome of every update is recorded in the progress journal, if one is
+    given. Returns the number of successful updates, and the failed UpdateResults.
+    """
+    lock = threading.Lock()
+    failed = []
+    succeeded = 0
+
+    def update(row):
+        nonlocal succeeded
+        line, key, data = row
+        try:
+            result = update_course_run(key, data, catalog_api_service)
+        except Exception as exc:
+            # An update which raised (e.g. the token could not be refreshed) is a failure like any other.
+            logging.error('Failed to update course run [%s]: %r', key, exc)
+            result = UpdateResult(key, False, None, str(exc))
+
+        # Count the outcome first, so that it is counted exactly once even if it cannot be written.
+        with lock:
+            if result.ok:
+                succeeded += 1
+            else:
+                failed.append(result)
+
+        if not result.ok and replay_file:
+            replay_file.write(line)
+        if progress_journal:
+            outcome = journal.UPDATED if result.ok else journal.FAILED
+            progress_journal.record(result.key, outcome, dry=False, error=result.error)
+
+    def on_error(row, exc):
+        logging.error('Failed to record the update of course run [%s]: %r', row[1], exc)
+
+    run_bounded(update, rows, workers, on_error)
+    return succeeded, failed
+
 
 def main():
     parser = argparse.ArgumentParser(description='Populates reporting type and announcment on course runs')
@@ -49,22 +270,118 @@ def main():
         default=os.environ.get('CATALOG_API_URL', 'https://prod-edx-discovery.edx.org/api/v1/'),
         help='Catalog API URL.'
     )
-
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.environ.get('CATALOG_WORKERS', 8)),
+        help='Number of course runs updated concurrently.'
+    )
+    parser.add_argument(
+        '--requests_per_second',
+        type=float,
+        default=float(os.environ.get('CATALOG_REQUESTS_PER_SECOND', 10)),
+        help='Maximum number of update requests sent per second, across all workers. 0 for no limit.'
+    )
+    parser.add_argument(
+        '--replay_filename',
+        help='Name of the file the lines which failed to update are written to, in the same format as the input. '
+             'Defaults to the input file name suffixed with _failed.'
+    )
+    parser.add_argument(
+        '--journal',
+        default=os.environ.get('CATALOG_JOURNAL'),
+        help='Name of the journal recording the outcome of each update. '
+             'Defaults to the input file name suffixed with _journal.jsonl.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip the course runs which the journal records as already updated.'
+    )
+    parser.add_argument(
+        '--validate_only',
+        action='store_true',
+        help='Only validate the file, without updating any course run.'
+    )
+    parser.add_argument(
+        '--skip_invalid',
+        action='store_true',
+        help='Update the course runs of the valid lines, even if some lines are invalid.'
+    )
+    parser.add_argument(
+        '--diff',
+        action='store_true',
+        help='Fetch the current values of the course runs in batches, and only update those which differ.'
+    )
+    parser.add_argument(
+        '--diff_batch_size',
+        type=int,
+        default=100,
+        help='Number of course runs whose current values are fetched with each list call.'
+    )
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
+
+    # Validate the whole file before making any request.
+    tally = Counter()
+    with open(args.filename) as f:
+        valid = sum(1 for __ in read_rows(csv.DictReader(f), tally))
+    logging.info(
+        f'{valid} course runs to update. {tally["invalid"]} invalid and {tally["duplicate"]} duplicate lines.'
+    )
+    if args.validate_only:
+        return
+    if tally['invalid'] and not args.skip_invalid:
+        logging.error('Fix the invalid lines, or re-run with --skip_invalid to ignore them.')
+        sys.exit(1)
+
     catalog_api_service = CatalogApiService(
         args.oauth_access_token_url,
         args.oauth_key,
         args.oauth_secret,
         args.catalog_api_url,
+        requests_per_second=args.requests_per_second or None,
+        pool_maxsize=args.workers,
     )
 
+    replay_filename = args.replay_filename or '{}_failed{}'.format(*os.path.splitext(args.filename))
+    if os.path.abspath(replay_filename) == os.path.abspath(args.filename):
+        parser.error('The replay file must not be the input file.')
+
+    progress_journal = journal.Journal(args.journal or f'{os.path.splitext(args.filename)[0]}_journal.jsonl')
+    completed = set()
+    if args.resume:
+        completed = progress_journal.completed_keys(dry=False)
+        logging.info(f'Resuming. {len(completed)} course runs were already updated, and will be skipped.')
+
     with open(args.filename) as f:
         reader = csv.DictReader(f)
-        for line in reader:
-            key, data = process_line(line)
-            update_course_run(key, data, catalog_api_service)
+        replay_file = ReplayFile(replay_filename, reader.fieldnames)
+        tally = Counter()
+        # Invalid and duplicate lines were already reported by the validation pass.
+        rows = (row for row in read_rows(reader, Counter(), report=False) if row[1] not in completed)
+        if args.diff:
+            rows = skip_up_to_date(rows, catalog_api_service, args.diff_batch_size, tally)
+        try:
+            succeeded, failed = update_course_runs(
+                rows, catalog_api_service, args.workers, replay_file, progress_journal
+            )
+        finally:
+            replay_file.close()
+            progress_journal.close()
+
+    if args.diff:
+        logging.info(f'{tally["up_to_date"]} course runs were already up to date.')
+    logging.info(f'{succeeded} course runs updated, {len(failed)} failed.')
+    if failed:
+        statuses = Counter(result.status for result in failed)
+        logging.warning(
+            'Failed to update course runs, by status: %s. Re-run with --filename %s to retry them.',
+            ', '.join(f'{status}: {count}' for status, count in statuses.most_common()),
+            replay_filename,
+        )
 
 
 if __name__ == "__main__":
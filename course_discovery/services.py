@@ -1,47 +1,94 @@
-import json
 import logging
+import os
+import sys
+from collections import namedtuple
 
 import requests
 
+# The API client is shared with the upgrade deadline repair script.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'upgrade_deadlines'))
+from api_client import ApiClient  # noqa: E402
+from rate_limit import TokenBucket  # noqa: E402
+
 logger = logging.getLogger()
 
+# Outcome of a course run update. The status is None if no response was received.
+UpdateResult = namedtuple('UpdateResult', ['key', 'ok', 'status', 'error'])
+
 
 class CatalogApiService:
-    """The service to interface with Catalog"""
+    """
+    The service to interface with Catalog.
+
+    The service can be shared by several threads. If a rate is given, their requests are
+    collectively held to it. Connection errors, rate limiting and transient server errors
+    are retried up to `retries` times, with exponential backoff. The JWT is refreshed by
+    the client before it expires, so a service can be used for as long as needed.
+    """
 
-    def __init__(self, oauth_access_token_url, oauth_key, oauth_secret, api_url_root):
+    def __init__(
+        self, oauth_access_token_url, oauth_key, oauth_secret, api_url_root, *, requests_per_second=None,
+        pool_maxsize=10, retries=5, backoff_factor=0.5,
+    ):
         self.oauth_key = oauth_key
         self.oauth_secret = oauth_secret
         self.api_url_root = api_url_root
+        self.client = ApiClient(
+            oauth_access_token_url,
+            oauth_key,
+            oauth_secret,
+            retries=retries,
+            backoff_factor=backoff_factor,
+            pool_maxsize=pool_maxsize,
+        )
+        self.limiter = TokenBucket(requests_per_second) if requests_per_second else None
         try:
-            response = requests.post(
-                oauth_access_token_url,
-                data={
-                    'grant_type': 'client_credentials',
-                    'client_id': oauth_key,
-                    'client_secret': oauth_secret,
-                    'token_type': 'jwt',
-                },
-                headers={
-                    'User-Agent': 'ecommerce-scripts',
-                },
-                timeout=(3.1, 5)
-            )
-            data = response.json()
-            self.access_token = data['access_token']
-        except (KeyError, json.decoder.JSONDecodeError) as json_error:
-            logger.exception('Failed to get access token from response.')
-            raise requests.RequestException(response=response) from json_error
+            # Fail early if the credentials are invalid.
+            self.client.get_access_token()
         except Exception:
             logger.exception('No access token acquired through client_credential flow.')
             raise
 
-        logger.info('Retrieved access token.')
+    def get_course_runs(self, keys, page_size=100):
+        """
+        Yield the course runs with the given keys, following the pages of the list endpoint.
+
+        Keys which do not match any course run are ignored by the API.
+        """
+        url = f'{self.api_url_root}course_runs/'
+        params = {'keys': ','.join(keys), 'page_size': page_size}
+        while url:
+            if self.limiter:
+                self.limiter.acquire()
+
+            response = self.client.get(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            yield from data['results']
+
+            # The next page's URL already carries the querystring.
+            url = data['next']
+            params = None
 
     def update_course_run(self, key, data):
-        headers = {'Authorization': "JWT {}".format(self.access_token)}
-        requests.patch(
-            f'{self.api_url_root}course_runs/{key}/',
-            json=data,
-            headers=headers
-        )
+        """
+        Update a course run, returning an UpdateResult.
+
+        Failures are reported in the result rather than raised. A failed result has already
+        been retried if it was transient, so it can be considered permanent for this run.
+        """
+        if self.limiter:
+            self.limiter.acquire()
+
+        try:
+            response = self.client.patch(
+                f'{self.api_url_root}course_runs/{key}/',
+                json=data,
+            )
+        except requests.RequestException as exc:
+            return UpdateResult(key, False, None, str(exc))
+
+        if not response.ok:
+            return UpdateResult(key, False, response.status_code, response.text[:200] or response.reason)
+
+        return UpdateResult(key, True, response.status_code, None)
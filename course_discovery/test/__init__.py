@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The populate script imports its services by name, since it is run as a script from its directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
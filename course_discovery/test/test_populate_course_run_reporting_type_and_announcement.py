@@ -0,0 +1,166 @@
+import os
+import random
+import time
+import unittest
+from collections import Counter
+from unittest.mock import MagicMock, patch
+
+from testfixtures import TempDirectory
+
+import populate_course_run_reporting_type_and_announcement as populate
+# The progress journal is imported by the populate script, from the upgrade deadline repair script.
+from populate_course_run_reporting_type_and_announcement import (
+    ReplayFile, journal, parse_announcement, read_rows, update_course_runs
+)
+from services import UpdateResult
+
+
+def line(key, reporting_type='mooc', announcement=''):
+    return {'course_run_key': key, 'reporting_type': reporting_type, 'announcement': announcement}
+
+
+class ReadRowsTestCases(unittest.TestCase):
+
+    def test_valid_lines(self):
+        lines = [
+            line('course-v1:edX+DemoX+1T2016', 'demo', '2/1/16'),
+            line('edX/DemoX/Demo_Course'),
+            line('ccx-v1:edX+DemoX+1T2016+ccx@3', 'spoc'),
+            line('course-v1:edX+Demo:X+1T2016', 'test'),
+        ]
+        tally = Counter()
+
+        rows = list(read_rows(lines, tally, report=False))
+
+        self.assertEqual(rows, [
+            (lines[0], 'course-v1:edX+DemoX+1T2016', {'reporting_type': 'demo', 'announcement': '2016-02-01T00:00:00'}),
+            (lines[1], 'edX/DemoX/Demo_Course', {'reporting_type': 'mooc'}),
+            (lines[2], 'ccx-v1:edX+DemoX+1T2016+ccx@3', {'reporting_type': 'spoc'}),
+            (lines[3], 'course-v1:edX+Demo:X+1T2016', {'reporting_type': 'test'}),
+        ])
+        self.assertEqual(tally, Counter())
+
+    def test_invalid_and_duplicate_lines_are_skipped(self):
+        lines = [
+            line('course-v1:edX+DemoX+1T2016'),
+            line('not a key'),
+            line('course-v1:edX+DemoX+2T2016', 'unknown'),
+            line('course-v1:edX+DemoX+3T2016', announcement='13/45/16'),
+            line('course-v1:edX+DemoX+1T2016', 'spoc'),
+        ]
+        tally = Counter()
+
+        keys = [key for _, key, _ in read_rows(lines, tally, report=False)]
+
+        self.assertEqual(keys, ['course-v1:edX+DemoX+1T2016'])
+        self.assertEqual(tally, Counter(invalid=3, duplicate=1))
+
+    def test_two_digit_years_pivot_like_dateutil(self):
+        self.assertEqual(parse_announcement('1/1/99'), '1999-01-01T00:00:00')
+        self.assertEqual(parse_announcement('3/4/00'), '2000-03-04T00:00:00')
+        self.assertEqual(parse_announcement('3/4/2000'), '2000-03-04T00:00:00')
+
+
+class UpdateCourseRunsTestCases(unittest.TestCase):
+
+    def test_raised_updates_are_failures(self):
+        catalog_api_service = MagicMock()
+        catalog_api_service.update_course_run.side_effect = [
+            UpdateResult('course-v1:edX+DemoX+1T2016', True, 200, None),
+            RuntimeError('Token refresh failed'),
+        ]
+        rows = [
+            (line('course-v1:edX+DemoX+1T2016'), 'course-v1:edX+DemoX+1T2016', {'reporting_type': 'mooc'}),
+            (line('course-v1:edX+DemoX+2T2016'), 'course-v1:edX+DemoX+2T2016', {'reporting_type': 'mooc'}),
+        ]
+        replay_file = MagicMock()
+
+        succeeded, failed = update_course_runs(rows, catalog_api_service, 1, replay_file)
+
+        self.assertEqual(succeeded, 1)
+        self.assertEqual(failed, [UpdateResult('course-v1:edX+DemoX+2T2016', False, None, 'Token refresh failed')])
+        replay_file.write.assert_called_once_with(rows[1][0])
+
+
+class FakeCatalogApiService:
+    """ Catalog service failing to update the course runs whose key ends with 'bad', after a random delay. """
+
+    def __init__(self):
+        self.updated = []
+
+    def update_course_run(self, key, data):
+        # Finish the updates out of order, so that workers complete behind the rows being submitted.
+        time.sleep(random.random() / 100)
+        self.updated.append(key)
+        if key.endswith('bad'):
+            return UpdateResult(key, False, 500, 'Server error')
+        return UpdateResult(key, True, 200, None)
+
+
+class ResumeTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TempDirectory()
+        self.journal_path = os.path.join(self.temp_dir.path, 'journal.jsonl')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_journal_records_outcomes_under_their_keys(self):
+        keys = [f'course-v1:edX+C{index}+{"bad" if index % 3 == 0 else "ok"}' for index in range(60)]
+        rows = [(line(key), key, {'reporting_type': 'mooc'}) for key in keys]
+        progress_journal = journal.Journal(self.journal_path)
+
+        succeeded, failed = update_course_runs(rows, FakeCatalogApiService(), 4, progress_journal=progress_journal)
+        progress_journal.close()
+
+        ok_keys = {key for key in keys if key.endswith('ok')}
+        self.assertEqual(succeeded, len(ok_keys))
+        self.assertEqual({result.key for result in failed}, set(keys) - ok_keys)
+        self.assertEqual(journal.Journal(self.journal_path).completed_keys(dry=False), ok_keys)
+
+    def test_resume_skips_completed_rows(self):
+        keys = ['course-v1:edX+C1+ok', 'course-v1:edX+C2+bad', 'course-v1:edX+C3+ok', 'course-v1:edX+C4+ok']
+        filename = self.temp_dir.write('runs.csv', '\n'.join(
+            ['course_run_key,reporting_type,announcement'] + [f'{key},mooc,' for key in keys]
+        ).encode())
+        progress_journal = journal.Journal(self.journal_path)
+        progress_journal.record(keys[0], journal.UPDATED, dry=False)
+        progress_journal.record(keys[1], journal.FAILED, dry=False, error='Server error')
+        progress_journal.close()
+
+        catalog_api_service = FakeCatalogApiService()
+        argv = ['populate', '--filename', filename, '--journal', self.journal_path, '--resume', '--workers', '2']
+        with patch('sys.argv', argv), patch.object(populate, 'CatalogApiService', return_value=catalog_api_service):
+            populate.main()
+
+        self.assertEqual(sorted(catalog_api_service.updated), keys[1:])
+        self.assertEqual(journal.Journal(self.journal_path).completed_keys(dry=False), {keys[0], keys[2], keys[3]})
+
+
+class ReplayFileTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TempDirectory()
+        self.path = os.path.join(self.temp_dir.path, 'runs_failed.csv')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_stale_file_is_removed(self):
+        self.temp_dir.write(self.path, b'course_run_key,reporting_type,announcement\nedX/Old/Run,mooc,\n')
+
+        ReplayFile(self.path, ['course_run_key', 'reporting_type', 'announcement']).close()
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_failed_lines_are_written(self):
+        replay_file = ReplayFile(self.path, ['course_run_key', 'reporting_type', 'announcement'])
+        replay_file.write(line('edX/DemoX/Demo_Course'))
+        replay_file.close()
+
+        with open(self.path) as f:
+            self.assertEqual(
+                f.read().splitlines(),
+                ['course_run_key,reporting_type,announcement', 'edX/DemoX/Demo_Course,mooc,'],
+            )
@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying: rate limiting and transient server errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Refresh the JWT this many seconds before it actually expires, so that it never
+# expires while a request is in flight.
+TOKEN_EXPIRY_MARGIN = 60
+
+
+class ApiClient:
+    """
+    HTTP client for edX services, authenticated with a JWT obtained through the
+    OAuth client credentials grant.
+
+    A single session is shared by all requests, so connections are pooled and kept
+    alive per host. Requests failing with a connection error or with one of the given
+    retry statuses are retried with exponential backoff, honoring Retry-After headers.
+    The JWT is refreshed shortly before it expires, and once more if a request is
+    rejected with a 401, in which case the request is resent unless `resend_unauthorized`
+    is off.
+
+    Arguments:
+        oauth_access_token_url (str): URL of the OAuth access token endpoint.
+        oauth_key (str): OAuth client ID.
+        oauth_secret (str): OAuth client secret.
+
+    Keyword Arguments:
+        retries (int): Maximum number of retries of a request.
+        backoff_factor (float): Retries wait backoff_factor * 2 ** (retry - 1) seconds.
+        retry_statuses (tuple): Response statuses which are retried.
+        pool_maxsize (int): Maximum number of connections kept alive per host. Should be
+            at least the number of threads sharing the client.
+        timeout (tuple): Connect and read timeouts of each request, in seconds.
+        resend_unauthorized (bool): Whether to resend a request rejected with a 401, with a
+            new JWT. Callers which pace their own requests can turn this off, and resend
+            the request themselves.
+    """
+    def __init__(self, oauth_access_token_url, oauth_key, oauth_secret, *, retries=5, backoff_factor=0.5,
+                 retry_statuses=RETRY_STATUSES, pool_maxsize=10, timeout=(3.1, 30), resend_unauthorized=True):
+        self.oauth_access_token_url = oauth_access_token_url
+        self.oauth_key = oauth_key
+        self.oauth_secret = oauth_secret
+        self.timeout = timeout
+        self.resend_unauthorized = resend_unauthorized
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            allowed_methods=frozenset(['GET', 'POST', 'PUT', 'PATCH']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'ecommerce-scripts'
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._access_token = None
+        self._access_token_expires_at = 0
+        self._lock = threading.Lock()
+
+    def get_access_token(self):
+        """
+        Return a valid JWT, requesting a new one if there is none yet or if it is about to expire.
+        """
+        with self._lock:
+            if self._access_token is None or time.monotonic() >= self._access_token_expires_at:
+                self._access_token, expires_in = self._request_access_token()
+                self._access_token_expires_at = time.monotonic() + expires_in - TOKEN_EXPIRY_MARGIN
+                logger.info('Retrieved access token.')
+
+            return self._access_token
+
+    def request(self, method, url, **kwargs):
+        """
+        Send an authenticated request. Takes the same arguments as requests.Session.request.
+
+        Any headers given are sent along with the authorization header.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        headers = kwargs.pop('headers', None) or {}
+
+        access_token = self.get_access_token()
+        response = self.session.request(method, url, headers=self._headers(access_token, headers), **kwargs)
+
+        if response.status_code == 401:
+            # The token may have been revoked, or may have expired earlier than announced.
+            with self._lock:
+                if self._access_token == access_token:
+                    self._access_token = None
+
+            if self.resend_unauthorized:
+                response = self.session.request(
+                    method, url, headers=self._headers(self.get_access_token(), headers), **kwargs
+                )
+
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def _headers(self, access_token, headers):
+        return dict(headers, Authorization=f'JWT {access_token}')
+
+    def _request_access_token(self):
+        response = self.session.post(
+            self.oauth_access_token_url,
+            data={
+                'grant_type': 'client_credentials',
+                'client_id': self.oauth_key,
+                'client_secret': self.oauth_secret,
+                'token_type': 'jwt',
+            },
+            timeout=(3.1, 5)
+        )
+
+        try:
+            data = response.json()
+            access_token = data['access_token']
+        except (KeyError, json.decoder.JSONDecodeError) as json_error:
+            logger.exception('Failed to get access token from response.')
+            raise requests.RequestException(response=response) from json_error
+        return access_token, data.get('expires_in', 3600)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Benchmark of the classification of a page of course runs, comparing the fast ISO-8601
+parsing path with dateutil's generic parser.
+
+    python benchmark_parsing.py
+    python benchmark_parsing.py --page course_runs_page.json
+
+By default, a page of synthetic runs is built with fake_services. Pass a response recorded
+from discovery with --page to benchmark real data.
+"""
+import argparse
+import json
+import timeit
+from unittest import mock
+
+from dateutil.parser import parse
+
+import repair
+from fake_services import build_course_runs
+
+
+def classify(course_runs):
+    return list(repair.classify_runs(course_runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the classification of a page of course runs.')
+    parser.add_argument('--page', help='Path of a JSON response recorded from the discovery course_runs endpoint.')
+    parser.add_argument('--page-size', type=int, default=50, help='Number of synthetic runs, when no page is given.')
+    parser.add_argument('--number', type=int, default=200, help='Number of times the page is classified.')
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page) as f:
+            course_runs = json.load(f)['results']
+    else:
+        course_runs = build_course_runs(args.page_size)
+
+    fast = classify(course_runs)
+    with mock.patch.object(repair, 'parse_datetime', parse):
+        assert classify(course_runs) == fast, 'Parsers disagree.'
+        slow_time = min(timeit.repeat(lambda: classify(course_runs), number=args.number, repeat=3))
+
+    fast_time = min(timeit.repeat(lambda: classify(course_runs), number=args.number, repeat=3))
+
+    pages = args.number
+    print(f'{len(course_runs)} runs per page, {len(fast)} classified runs.')
+    print(f'dateutil:      {slow_time / pages * 1000:8.3f} ms/page')
+    print(f'fromisoformat: {fast_time / pages * 1000:8.3f} ms/page ({slow_time / fast_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
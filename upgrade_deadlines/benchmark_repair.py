@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the repair against local stand-ins for discovery and ecommerce,
+comparing serial requests with the concurrent discovery crawl and update workers.
+
+    python benchmark_repair.py --runs 20000 --latency 0.05 --updates 10
+
+Ecommerce enforces its rate limit of 50 requests per minute, and updating a run takes two
+requests, so updates are expected to top out at 25 per minute in both modes.
+"""
+import argparse
+import importlib
+import os
+import time
+from unittest import mock
+
+from fake_services import FakeServices
+
+
+def crawl(repair, *, filtered):
+    """
+    Crawl and classify every course run, returning (pages, runs, seconds, runs to update).
+    """
+    discovery = repair.DiscoveryClient(filtered=filtered)
+
+    pages = 0
+    runs = 0
+    candidates = []
+    start = time.perf_counter()
+    for course_runs in discovery.iter_pages():
+        pages += 1
+        runs += len(course_runs)
+        candidates.extend(
+            run for category, run in repair.classify_runs(course_runs) if category == repair.DEADLINE_EMPTY_WITH_END
+        )
+    return pages, runs, time.perf_counter() - start, candidates
+
+
+def update(repair, runs, *, workers):
+    """
+    Update the given runs through ecommerce, returning the seconds taken.
+    """
+    ecommerce = repair.EcommerceClient()
+    start = time.perf_counter()
+    repair.update_runs(ecommerce, runs, dry=False, workers=workers)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the repair against local stand-ins for its services.')
+    parser.add_argument('--runs', type=int, default=20000, help='Number of course runs served by discovery.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each response is delayed by.')
+    parser.add_argument('--updates', type=int, default=10, help='Number of runs updated in each mode.')
+    parser.add_argument('--rate-limit', type=int, default=50, help='Number of ecommerce requests allowed per minute.')
+    parser.add_argument('--filter', action='store_true', help='Ask discovery to filter and project the course runs.')
+    args = parser.parse_args()
+
+    services = FakeServices(run_count=args.runs, latency=args.latency, rate_limit=args.rate_limit)
+    services.start()
+
+    # repair reads its settings from the environment when it is imported.
+    os.environ.update(services.environ())
+    repair = importlib.import_module('repair')
+
+    modes = (
+        ('serial', 1, 1),
+        ('concurrent', repair.DISCOVERY_CONCURRENCY, repair.ECOMMERCE_WORKERS),
+    )
+
+    print(f'{args.runs} runs, {args.latency * 1000:.0f} ms latency, {args.rate_limit} ecommerce requests/min.')
+    try:
+        for name, concurrency, workers in modes:
+            with mock.patch.object(repair, 'DISCOVERY_CONCURRENCY', concurrency):
+                pages, runs, crawl_time, candidates = crawl(repair, filtered=args.filter)
+
+            services.counts.clear()
+            update_time = update(repair, candidates[:args.updates], workers=workers)
+            updates = min(len(candidates), args.updates)
+            throttled = services.counts['ecommerce', 429]
+
+            print(
+                f'{name:<10} (discovery concurrency {concurrency}, {workers} workers): '
+                f'{pages / crawl_time:8.1f} pages/s, {runs / crawl_time:9.0f} runs classified/s, '
+                f'{updates / update_time * 60:5.1f} updates/min ({throttled} throttled)'
+            )
+    finally:
+        services.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Local stand-ins for the OAuth provider, the discovery service and the ecommerce service,
+used to exercise repair.py end to end without production credentials.
+
+    server = FakeServices(run_count=5000, latency=0.05)
+    server.start()
+    ...
+    server.stop()
+
+Every path is served by a single threaded HTTP server:
+
+    /oauth2/access_token                     Issues a JWT.
+    /discovery/api/v1/course_runs/           Paginated synthetic course runs.
+    /ecommerce/api/v2/courses/<key>/         A course with its seat products.
+    /ecommerce/api/v2/publication/<key>      Accepts publications (PUT). Like ecommerce's route, no trailing slash.
+
+Ecommerce allows at most `rate_limit` requests in any 60 second window, and responds to
+the others with a 429 and a Retry-After header, like the real service.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Share of runs in each shape, roughly matching the production catalog.
+RUN_SHAPES = (
+    ('audit_only', 0.35),
+    ('verified', 0.40),
+    ('verified_missing_deadline', 0.10),
+    ('verified_missing_deadline_and_end', 0.03),
+    ('verified_deadline_after_end', 0.02),
+    ('professional', 0.10),
+)
+
+ORGS = ('HarvardX', 'MITx', 'DelftX', 'UQx', 'BerkeleyX', 'edX')
+
+# Ecommerce's COURSE_ID_PATTERN, used by its courses and publication routes.
+COURSE_ID_PATTERN = r'(?P<key>[^/+]+(/|\+)[^/+]+(/|\+)[^/]+)'
+
+
+def build_seat(rng, seat_type, upgrade_deadline=None, price='0.00'):
+    return {
+        'type': seat_type,
+        'price': price,
+        'currency': 'USD',
+        'upgrade_deadline': upgrade_deadline,
+        'credit_provider': None,
+        'credit_hours': None,
+        'sku': f'{rng.getrandbits(28):07X}',
+        'bulk_sku': None,
+    }
+
+
+def build_course_runs(count, seed=0):
+    """
+    Build `count` synthetic course runs, shaped like the discovery service's course_runs endpoint.
+    """
+    rng = random.Random(seed)
+    shapes, weights = zip(*RUN_SHAPES)
+
+    course_runs = []
+    for index in range(count):
+        shape = rng.choices(shapes, weights)[0]
+        org = rng.choice(ORGS)
+        year = rng.randint(2013, 2022)
+        term = rng.randint(1, 4)
+        start = f'{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00Z'
+        end = f'{year + 1}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T23:30:00Z'
+        deadline = f'{year + 1}-01-01T00:00:00Z'
+
+        if shape == 'audit_only':
+            seats = [build_seat(rng, 'audit')]
+        elif shape == 'verified':
+            seats = [build_seat(rng, 'audit'), build_seat(rng, 'verified', deadline, '49.00')]
+        elif shape == 'verified_missing_deadline':
+            seats = [build_seat(rng, 'audit'), build_seat(rng, 'verified', None, '49.00')]
+        elif shape == 'verified_missing_deadline_and_end':
+            seats = [build_seat(rng, 'audit'), build_seat(rng, 'verified', None, '49.00')]
+            end = None
+        elif shape == 'verified_deadline_after_end':
+            seats = [build_seat(rng, 'audit'), build_seat(rng, 'verified', f'{year + 3}-01-01T00:00:00Z', '49.00')]
+        else:
+            seats = [build_seat(rng, 'professional', None, '300.00')]
+
+        key = f'course-v1:{org}+C{index}x+{term}T{year}'
+        course_runs.append({
+            'course': f'{org}+C{index}x',
+            'key': key,
+            'uuid': f'{rng.getrandbits(128):032x}',
+            'title': f'Course {index}',
+            'short_description': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 4,
+            'start': start,
+            'end': end,
+            'enrollment_start': None,
+            'enrollment_end': None,
+            'pacing_type': rng.choice(('self_paced', 'instructor_paced')),
+            'type': 'verified' if any(seat['type'] == 'verified' for seat in seats) else seats[0]['type'],
+            'status': 'published',
+            'seats': seats,
+            'content_language': 'en-us',
+            'transcript_languages': ['en-us'],
+            'staff': [],
+            'hidden': False,
+        })
+
+    return course_runs
+
+
+def build_course(key):
+    """
+    Build an ecommerce course, with its products, as returned by the courses API.
+    """
+    def seat(certificate_type, price):
+        return {
+            'product_class': 'Seat',
+            'structure': 'child',
+            'expires': None,
+            'price': price,
+            'attribute_values': [
+                {'name': 'certificate_type', 'value': certificate_type},
+                {'name': 'course_key', 'value': key},
+                {'name': 'id_verification_required', 'value': certificate_type == 'verified'},
+            ],
+        }
+
+    return {
+        'id': key,
+        'name': key,
+        'verification_deadline': None,
+        'products': [
+            {'product_class': 'Seat', 'structure': 'parent', 'expires': None, 'price': None, 'attribute_values': []},
+            seat('audit', '0.00'),
+            seat('verified', '49.00'),
+        ],
+    }
+
+
+class FakeServices:
+    """
+    Threaded HTTP server standing in for the OAuth provider, discovery and ecommerce.
+
+    Keyword Arguments:
+        run_count (int): Number of course runs served by discovery.
+        latency (float): Seconds each response is delayed by.
+        rate_limit (int): Number of ecommerce requests allowed per minute.
+        seed (int): Seed of the synthetic course runs.
+    """
+    def __init__(self, *, run_count=5000, latency=0.0, rate_limit=50, seed=0):
+        self.course_runs = build_course_runs(run_count, seed)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        # Tallies of the responses, by service and status.
+        self.counts = Counter()
+
+        self._lock = threading.Lock()
+        self._ecommerce_requests = deque()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def environ(self):
+        """
+        Return the environment variables pointing repair.py at these services.
+        """
+        return {
+            'OAUTH_ACCESS_TOKEN_URL': f'{self.url}/oauth2',
+            'OAUTH_KEY': 'key',
+            'OAUTH_SECRET': 'secret',
+            'DISCOVERY_API_URL': f'{self.url}/discovery/api/v1/',
+            'ECOMMERCE_URL': f'{self.url}/ecommerce',
+            'ECOMMERCE_RATE_LIMIT': str(self.rate_limit),
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def course_runs_page(self, query):
+        page = int(query.get('page', ['1'])[0])
+        page_size = int(query.get('page_size', ['20'])[0])
+
+        course_runs = self.course_runs
+        if 'seat_type' in query:
+            seat_type = query['seat_type'][0]
+            course_runs = [run for run in course_runs if any(seat['type'] == seat_type for seat in run['seats'])]
+
+        results = course_runs[(page - 1) * page_size:page * page_size]
+        if 'fields' in query:
+            fields = query['fields'][0].split(',')
+            results = [{field: run[field] for field in fields if field in run} for run in results]
+
+        page_count = math.ceil(len(course_runs) / page_size)
+        return {
+            'count': len(course_runs),
+            'next': f'{self.url}/discovery/api/v1/course_runs/?page={page + 1}' if page < page_count else None,
+            'previous': None,
+            'results': results,
+        }
+
+    def record(self, service, status):
+        with self._lock:
+            self.counts[service, status] += 1
+
+    def throttle(self):
+        """
+        Record an ecommerce request, and return the seconds to wait if it exceeds the rate limit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._ecommerce_requests and self._ecommerce_requests[0] <= now - 60:
+                self._ecommerce_requests.popleft()
+
+            if len(self._ecommerce_requests) >= self.rate_limit:
+                return self._ecommerce_requests[0] + 60 - now
+
+            self._ecommerce_requests.append(now)
+            return None
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+            def do_GET(self):
+                self.route('GET')
+
+            def do_POST(self):
+                self.route('POST')
+
+            def do_PUT(self):
+                self.route('PUT')
+
+            def route(self, method):
+                length = int(self.headers.get('Content-Length', 0))
+                if length:
+                    self.rfile.read(length)
+
+                time.sleep(services.latency)
+                url = urlparse(self.path)
+
+                if method == 'POST' and url.path == '/oauth2/access_token':
+                    self.respond('oauth', 200, {'access_token': 'fake', 'expires_in': 3600})
+                elif method == 'GET' and url.path == '/discovery/api/v1/course_runs/':
+                    self.respond('discovery', 200, services.course_runs_page(parse_qs(url.query)))
+                elif url.path.startswith('/ecommerce/'):
+                    self.ecommerce(method, url.path)
+                else:
+                    self.respond('unknown', 404, {'detail': 'Not found.'})
+
+            def ecommerce(self, method, path):
+                delay = services.throttle()
+                if delay is not None:
+                    self.respond('ecommerce', 429, {'detail': 'Request was throttled.'}, {
+                        'Retry-After': str(math.ceil(delay)),
+                    })
+                    return
+
+                course = re.fullmatch(rf'/ecommerce/api/v2/courses/{COURSE_ID_PATTERN}/', path)
+                publication = re.fullmatch(rf'/ecommerce/api/v2/publication/{COURSE_ID_PATTERN}', path)
+                if method == 'GET' and course:
+                    self.respond('ecommerce', 200, build_course(unquote(course.group('key'))))
+                elif method == 'PUT' and publication:
+                    self.respond('ecommerce', 200, {'id': unquote(publication.group('key'))})
+                else:
+                    self.respond('ecommerce', 404, {'detail': 'Not found.'})
+
+            def respond(self, service, status, data, headers=None):
+                services.record(service, status)
+
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+UPDATED = 'updated'
+FAILED = 'failed'
+
+
+class Journal:
+    """
+    Append-only journal of the outcome of each run update, stored as JSON lines.
+
+    Every outcome is flushed to disk as soon as it is recorded, so the journal survives
+    a crash and can be used to resume an interrupted repair.
+
+    Arguments:
+        path (str): Path of the journal file. It is created if it does not exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def completed_keys(self, *, dry):
+        """
+        Return the keys of the runs which were successfully updated, in the same (dry or not) mode.
+
+        If a run was recorded several times, its last outcome wins.
+        """
+        if not os.path.exists(self.path):
+            return set()
+
+        outcomes = {}
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # The last line may have been cut short by a crash.
+                    logger.warning(f'Ignoring malformed journal entry: {line!r}')
+                    continue
+
+                if entry['dry'] == dry:
+                    outcomes[entry['key']] = entry['outcome']
+
+        return {key for key, outcome in outcomes.items() if outcome == UPDATED}
+
+    def record(self, key, outcome, *, dry, deadline=None, error=None):
+        """
+        Record the outcome of a run update.
+
+        Arguments:
+            key (str): Key identifying the course run.
+            outcome (str): UPDATED or FAILED.
+
+        Keyword Arguments:
+            dry (bool): Whether the update was a dry run.
+            deadline (datetime.datetime): Upgrade deadline set for the run.
+            error (str): Description of the failure, if any.
+        """
+        entry = {
+            'key': key,
+            'outcome': outcome,
+            'dry': dry,
+            'deadline': deadline.isoformat() if deadline else None,
+            'error': error,
+            'recorded_at': datetime.utcnow().isoformat(),
+        }
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
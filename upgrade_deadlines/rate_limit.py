@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens are added at a constant rate, up to the capacity of the bucket, and each
+    request consumes one. Callers sharing a bucket are collectively held to the
+    configured rate, however long their requests take, since time spent waiting on
+    responses is not added to the time spent waiting for tokens.
+
+    Arguments:
+        rate (float): Number of tokens added per second.
+
+    Keyword Arguments:
+        capacity (int): Maximum number of tokens which can accumulate, i.e. the
+            largest allowed burst of requests.
+    """
+    def __init__(self, rate, *, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute, **kwargs):
+        return cls(requests_per_minute / 60, **kwargs)
+
+    def acquire(self):
+        """
+        Block until a token is available, then consume it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._blocked_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                    self._updated_at = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._blocked_until - now
+
+            time.sleep(wait)
+
+    def backoff(self, delay):
+        """
+        Stop handing out tokens for the given number of seconds, e.g. after being told
+        to slow down with a 429 response.
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._tokens = 0
+            self._updated_at = self._blocked_until
@@ -1,61 +1,104 @@
 #!/usr/bin/env python
+import argparse
 import datetime
 import json
 import logging
+import math
 import os
-from collections import namedtuple
-from time import sleep
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-import dryscrape
 import requests
 from dateutil.parser import parse
 
+import journal
+import snapshot
+from api_client import ApiClient
+from rate_limit import TokenBucket
+from worker_pool import run_bounded
+
 logger = logging.getLogger(__name__)
 
 Run = namedtuple('Run', ['key', 'upgrade_deadline', 'end'])
 
+# Categories of runs identified by classify_runs.
+DEADLINE_EMPTY_WITH_END = 'deadline_empty_with_end'
+DEADLINE_EMPTY_WITHOUT_END = 'deadline_empty_without_end'
+DEADLINE_AFTER_END = 'deadline_after_end'
+
 OAUTH_ACCESS_TOKEN_URL = os.environ.get('OAUTH_ACCESS_TOKEN_URL', 'https://courses.edx.org/oauth2')
 OAUTH_KEY = os.environ.get('OAUTH_KEY')
 OAUTH_SECRET = os.environ.get('OAUTH_SECRET')
 
 DISCOVERY_API_URL = os.environ.get('DISCOVERY_API_URL', 'https://prod-edx-discovery.edx.org/api/v1/')
+# Maximum number of course run pages requested from the discovery service at the same time.
+DISCOVERY_CONCURRENCY = int(os.environ.get('DISCOVERY_CONCURRENCY', 8))
+# Number of course runs requested per page. Filtered pages are much smaller, so more fit in a page.
+DISCOVERY_PAGE_SIZE = int(os.environ.get('DISCOVERY_PAGE_SIZE', 50))
+DISCOVERY_FILTERED_PAGE_SIZE = int(os.environ.get('DISCOVERY_FILTERED_PAGE_SIZE', 500))
+# Fields of a course run read by classify_runs. When filtering, discovery is asked to omit the others.
+COURSE_RUN_FIELDS = ('key', 'end', 'seats')
+# Only runs with a seat of this type can have a missing upgrade deadline.
+UPGRADE_SEAT_TYPE = 'verified'
 ECOMMERCE_URL = os.environ.get('ECOMMERCE_URL', 'https://ecommerce.edx.org')
-
-LMS_EMAIL = os.environ.get('LMS_EMAIL')
-LMS_PASSWORD = os.environ.get('LMS_PASSWORD')
+# Number of requests per minute allowed by the ecommerce service.
+ECOMMERCE_RATE_LIMIT = float(os.environ.get('ECOMMERCE_RATE_LIMIT', 50))
+# Number of runs updated concurrently.
+ECOMMERCE_WORKERS = int(os.environ.get('ECOMMERCE_WORKERS', 4))
+# Number of times a request to ecommerce is retried, after a 429, a 401, a transient server error or a connection
+# error. Every attempt takes a token from the rate limiter.
+ECOMMERCE_RETRIES = 5
+# Retries after a transient error wait ECOMMERCE_BACKOFF_FACTOR * 2 ** (retry - 1) seconds.
+ECOMMERCE_BACKOFF_FACTOR = 0.5
+
+# Path of the journal recording the outcome of each run update.
+REPAIR_JOURNAL = os.environ.get('REPAIR_JOURNAL', 'repair_journal.jsonl')
+
+# Path of the local snapshot of discovery's course runs. No snapshot is kept if unset.
+DISCOVERY_SNAPSHOT = os.environ.get('DISCOVERY_SNAPSHOT')
+
+
+# Shared by all requests, so connections to each service are kept alive and reused.
+client = ApiClient(
+    f'{OAUTH_ACCESS_TOKEN_URL}/access_token',
+    OAUTH_KEY,
+    OAUTH_SECRET,
+    pool_maxsize=DISCOVERY_CONCURRENCY,
+)
+
+# Requests to ecommerce are paced by a rate limiter, which has to see every request sent,
+# so this client neither retries nor resends requests itself. EcommerceClient does.
+ecommerce_client = ApiClient(
+    f'{OAUTH_ACCESS_TOKEN_URL}/access_token',
+    OAUTH_KEY,
+    OAUTH_SECRET,
+    retries=0,
+    retry_statuses=(),
+    pool_maxsize=ECOMMERCE_WORKERS,
+    resend_unauthorized=False,
+)
 
 
 def get_access_token():
-    response = requests.post(
-        f'{OAUTH_ACCESS_TOKEN_URL}/access_token',
-        data={
-            'grant_type': 'client_credentials',
-            'client_id': OAUTH_KEY,
-            'client_secret': OAUTH_SECRET,
-            'token_type': 'jwt',
-        },
-        headers={
-            'User-Agent': 'ecommerce-scripts',
-        },
-        timeout=(3.1, 5)
-    )
+    return client.get_access_token()
 
-    try:
-        data = response.json()
-        access_token = data['access_token']
-    except (KeyError, json.decoder.JSONDecodeError) as json_error:
-        logger.exception('Failed to get access token from response.')
-        raise requests.RequestException(response=response) from json_error
-    return access_token
 
-
-def get_course_runs(jwt, querystring):
-    headers = {'Authorization': "JWT {}".format(jwt)}
-    response = requests.get(
+def request_course_runs(querystring, headers=None):
+    """
+    Request a page of course runs. The response may be a 304 if conditional headers are given.
+    """
+    response = client.get(
         f'{DISCOVERY_API_URL}course_runs/',
         params=querystring,
-        headers=headers
+        headers=headers,
     )
+    response.raise_for_status()
+    return response
+
+
+def read_course_runs(response):
     try:
         data = response.json()
     except json.decoder.JSONDecodeError as json_error:
@@ -63,118 +106,342 @@ def get_course_runs(jwt, querystring):
     return data
 
 
+def get_course_runs(querystring):
+    return read_course_runs(request_course_runs(querystring))
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO-8601 datetime, as returned by the discovery service.
+
+    datetime.fromisoformat is an order of magnitude faster than dateutil's generic parser,
+    but only understands the formats produced by datetime.isoformat (and, before Python 3.11,
+    no "Z" suffix). dateutil is used as a fallback for anything else.
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return parse(value)
+
+
+def classify_runs(course_runs):
+    """
+    Classify course runs based on the upgrade deadlines of their verified seats and their end dates.
+
+    Yields:
+        tuple: The category of a seat's run (one of DEADLINE_EMPTY_WITH_END,
+            DEADLINE_EMPTY_WITHOUT_END and DEADLINE_AFTER_END), and the run.
+    """
+    for course_run in course_runs:
+        key = course_run['key']
+        end = course_run['end']
+        parsed_end = parse_datetime(end) if end else None
+
+        for seat in course_run['seats']:
+            upgrade_deadline = seat['upgrade_deadline']
+
+            if seat['type'] == 'verified' and not upgrade_deadline:
+                if end:
+                    yield DEADLINE_EMPTY_WITH_END, Run(key, None, parsed_end)
+                else:
+                    yield DEADLINE_EMPTY_WITHOUT_END, Run(key, None, None)
+
+            if upgrade_deadline and end:
+                parsed_upgrade_deadline = parse_datetime(upgrade_deadline)
+
+                if parsed_upgrade_deadline > parsed_end:
+                    yield DEADLINE_AFTER_END, Run(key, parsed_upgrade_deadline, parsed_end)
+
+
 class DiscoveryClient:
     """
     Interface to the discovery service.
     """
-    def __init__(self):
-        self.jwt = get_access_token()
-        self.deadline_empty_with_end = []
-        self.deadline_empty_without_end = []
-        self.deadline_after_end = []
+    def __init__(self, snapshot=None, offline=False, filtered=False):
+        """
+        Keyword Arguments:
+            snapshot (Snapshot): Local copy of the course runs. Pages which have not changed since
+                the snapshot was taken are read from it, and changed pages are written to it.
+            offline (bool): Read the course runs from the snapshot only, without contacting discovery.
+            filtered (bool): Ask discovery to filter and project the course runs. See build_querystring.
+        """
+        if offline and snapshot is None:
+            raise ValueError('A snapshot is required to read course runs offline.')
+
+        if not offline:
+            # Fail early if the credentials are invalid.
+            get_access_token()
+
+        self.snapshot = snapshot
+        self.offline = offline
+        self.filtered = filtered
+        # Running tallies of the runs classified so far, by category.
+        self.counts = Counter()
+
+    def iter_pages(self):
+        """
+        Yield the course runs of each page of the discovery service's course runs, in page order.
 
-    def load_runs(self):
+        The first page is requested on its own, to learn how many runs there are. The
+        remaining pages are requested concurrently, but at most DISCOVERY_CONCURRENCY
+        pages are requested ahead of the page being consumed, so memory usage does not
+        grow with the size of the catalog.
+
+        With a snapshot, each page is requested conditionally on the validators stored with
+        it, and the stored runs are used when discovery answers that the page has not changed.
+        """
+        querystring = self.build_querystring()
+
+        if self.offline:
+            logger.info(f'Reading course runs from the snapshot at {self.snapshot.path}.')
+            yield from self.snapshot.iter_pages(querystring)
+            return
+
+        if self.snapshot:
+            # The snapshot is keyed on the querystring as requested, before any page size cap.
+            self.snapshot.use_query(querystring)
+            requested_querystring = dict(querystring)
+
+        logger.info('Requesting page 1.')
+        response = request_course_runs(querystring, self._conditional_headers(1))
+        data = None
+        if response.status_code == 304:
+            count = self.snapshot.count()
+        else:
+            data = read_course_runs(response)
+            count = data['count']
+        results = self._receive_page(1, response, data)
+        if len(results) < min(count, querystring['page_size']):
+            # Discovery caps the page size. Request the remaining pages at the size it uses.
+            logger.warning(f'Discovery returned {len(results)} runs per page, instead of {querystring["page_size"]}.')
+            querystring['page_size'] = len(results)
+        if self.snapshot:
+            self.snapshot.start_crawl(count, querystring['page_size'], requested_querystring)
+        yield results
+
+        page_count = max(math.ceil(count / querystring['page_size']), 1)
+        if page_count > 1:
+            logger.info(f'Requesting pages 2 to {page_count}, {DISCOVERY_CONCURRENCY} at a time.')
+
+            with ThreadPoolExecutor(max_workers=DISCOVERY_CONCURRENCY) as executor:
+                in_flight = deque()
+                for page in range(2, page_count + 1):
+                    future = executor.submit(
+                        request_course_runs,
+                        dict(querystring, page=page),
+                        self._conditional_headers(page),
+                    )
+                    in_flight.append((page, future))
+                    if len(in_flight) >= DISCOVERY_CONCURRENCY:
+                        page, future = in_flight.popleft()
+                        yield self._receive_page(page, future.result())
+
+                while in_flight:
+                    page, future = in_flight.popleft()
+                    yield self._receive_page(page, future.result())
+
+        if self.snapshot:
+            self.snapshot.complete_crawl(page_count)
+
+    def build_querystring(self):
         """
-        Load runs from the discovery service, classifying them based on their
-        upgrade deadlines and end dates.
+        Build the querystring of the first page of course runs.
+
+        When filtering, discovery is asked for the runs with a verified seat only, and for only
+        the fields read by classify_runs, in larger pages. Discovery ignores the parameters it
+        does not support, and every run received is still classified locally, so filtering
+        only reduces how much is transferred and parsed. Runs without a verified seat, which
+        are never repaired, are left out of the DEADLINE_AFTER_END tally.
         """
         querystring = {
             'page': 1,
-            'page_size': 50,
+            'page_size': DISCOVERY_PAGE_SIZE,
         }
 
-        next_page = True
-        while next_page:
-            number = querystring['page']
-            logger.info(f'Requesting page {number}.')
-            data = get_course_runs(self.jwt, querystring)
-
-            course_runs = data['results']
-            next_page = data['next']
-            if next_page:
-                querystring['page'] += 1
-
-            for course_run in course_runs:
-                key = course_run['key']
-                end = course_run['end']
-
-                for seat in course_run['seats']:
-                    upgrade_deadline = seat['upgrade_deadline']
-
-                    if seat['type'] == 'verified' and not upgrade_deadline:
-                        if end:
-                            run = Run(key, None, parse(end))
-                            self.deadline_empty_with_end.append(run)
-                        else:
-                            run = Run(key, None, None)
-                            self.deadline_empty_without_end.append(run)
-
-                    if upgrade_deadline and end:
-                        parsed_upgrade_deadline = parse(seat['upgrade_deadline'])
-                        parsed_end = parse(end)
-
-                        if parsed_upgrade_deadline > parsed_end:
-                            run = Run(key, parsed_upgrade_deadline, parsed_end)
-                            self.deadline_after_end.append(run)
-
-        empty_deadline_count = len(self.deadline_empty_with_end + self.deadline_empty_without_end)
+        if self.filtered:
+            querystring.update({
+                'page_size': DISCOVERY_FILTERED_PAGE_SIZE,
+                'seat_type': UPGRADE_SEAT_TYPE,
+                'fields': ','.join(COURSE_RUN_FIELDS),
+            })
+
+        return querystring
+
+    def _conditional_headers(self, page):
+        headers = {}
+        if not self.snapshot:
+            return headers
+
+        validators = self.snapshot.validators(page)
+        if validators:
+            etag, last_modified = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _receive_page(self, page, response, data=None):
+        if response.status_code == 304:
+            logger.info(f'Page {page} has not changed since the snapshot.')
+            return self.snapshot.page_runs(page)
+
+        if data is None:
+            data = read_course_runs(response)
+        logger.info(f'Received page {page}.')
+        if self.snapshot:
+            self.snapshot.store_page(
+                page,
+                data['results'],
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            )
+        return data['results']
+
+    def iter_runs(self):
+        """
+        Yield runs from the discovery service, classified based on their upgrade deadlines
+        and end dates, while pages are still being loaded.
+
+        Yields:
+            tuple: The category of the run, and the run. See classify_runs.
+        """
+        for course_runs in self.iter_pages():
+            for category, run in classify_runs(course_runs):
+                self.counts[category] += 1
+
+                if category == DEADLINE_EMPTY_WITHOUT_END:
+                    logger.info(f'{run.key} is missing an end date and a verified seat upgrade deadline.')
+                elif category == DEADLINE_AFTER_END:
+                    logger.info(
+                        f'{run.key} ends at {run.end}, but has a verified seat with upgrade deadline set to {run.upgrade_deadline}'
+                    )
+
+                yield category, run
+
+    def log_summary(self):
+        """
+        Log the tallies of the runs classified so far.
+        """
+        empty_deadline_count = self.counts[DEADLINE_EMPTY_WITH_END] + self.counts[DEADLINE_EMPTY_WITHOUT_END]
         logger.info(
             f'{empty_deadline_count} verified seats are missing an upgrade deadline.'
         )
 
-        count = len(self.deadline_empty_without_end)
+        count = self.counts[DEADLINE_EMPTY_WITHOUT_END]
         logger.info(
-            f'{count} of the runs linked to these seats are also missing an end date:'
+            f'{count} of the runs linked to these seats are also missing an end date.'
         )
 
-        for run in self.deadline_empty_without_end:
-            logger.info(run.key)
-
-        count = len(self.deadline_after_end)
+        count = self.counts[DEADLINE_AFTER_END]
         logger.info(
-            f'{count} runs have an upgrade deadline set after their end date:'
+            f'{count} runs have an upgrade deadline set after their end date.'
         )
 
-        for run in self.deadline_after_end:
-            logger.info(
-                f'{run.key} ends at {run.end}, but has a verified seat with upgrade deadline set to {run.upgrade_deadline}'
-            )
-
 
-class CatClient:
-    """
-    Interface to the ecommerce service's course admin tool (CAT).
+def build_publication(course, deadline):
     """
-    def __init__(self):
-        self.cat_path = '/courses'
+    Build the ecommerce publication API payload which sets the upgrade deadline of a course's verified seat.
 
-        dryscrape.start_xvfb()
-        self.session = dryscrape.Session(base_url=ECOMMERCE_URL)
+    Arguments:
+        course (dict): Course, with its products, as returned by the ecommerce courses API.
+        deadline (str): Upgrade deadline to set, formatted as an ISO-8601 datetime.
+    """
+    products = []
+    for product in course['products']:
+        if product['product_class'] != 'Seat' or product['structure'] != 'child':
+            continue
+
+        attribute_values = [
+            {'name': attribute['name'], 'value': attribute['value']} for attribute in product['attribute_values']
+        ]
+        certificate_type = next(
+            (attribute['value'] for attribute in attribute_values if attribute['name'] == 'certificate_type'), None
+        )
 
-        # No need to load images.
-        self.session.set_attribute('auto_load_images', False)
+        products.append({
+            'product_class': 'Seat',
+            'expires': deadline if certificate_type == 'verified' else product['expires'],
+            'price': product['price'],
+            'attribute_values': attribute_values,
+        })
 
-    def login(self):
-        """
-        Log in to the ecommerce service.
-        """
-        logger.info('Logging in to CAT.')
+    return {
+        'id': course['id'],
+        'name': course['name'],
+        'verification_deadline': course['verification_deadline'],
+        'products': products,
+    }
 
-        self.session.visit(self.cat_path)
 
-        # Wait for the LMS login page to render.
-        self.session.wait_for(lambda: self.session.at_css('#login-form'))
+class EcommerceClient:
+    """
+    Interface to the ecommerce service's courses and publication APIs.
 
-        email_input_selector = '#login-email'
-        password_input_selector = '#login-password'
-        login_button_selector = '.login-button'
+    Requests are paced by a token bucket shared by all threads using the client, which
+    backs off when the ecommerce service responds with a 429. Every attempt of a request,
+    including retries, takes a token, so the rate limit holds even when requests fail.
 
-        self.session.at_css(email_input_selector).set(LMS_EMAIL)
-        self.session.at_css(password_input_selector).set(LMS_PASSWORD)
-        self.session.at_css(login_button_selector).click()
+    Keyword Arguments:
+        requests_per_minute (float): Rate limit of the ecommerce service.
+        check_credentials (bool): Request an access token right away, to fail early if the
+            credentials are invalid. Dry runs make no requests, so they can skip this.
+    """
+    def __init__(self, *, requests_per_minute=ECOMMERCE_RATE_LIMIT, check_credentials=True):
+        if check_credentials:
+            ecommerce_client.get_access_token()
+        self.limiter = TokenBucket.per_minute(requests_per_minute)
 
-        # Wait for the CAT to render.
-        self.session.wait_for(lambda: self.session.at_css('#app'))
+    def request(self, method, url, **kwargs):
+        """
+        Send a rate limited request to the ecommerce service, retrying it up to ECOMMERCE_RETRIES
+        times after a 429, a 401 (with a new JWT), a transient server error or a connection error.
+        """
+        for retry in range(ECOMMERCE_RETRIES + 1):
+            if retry:
+                logger.warning(f'Retrying {method} {url} (retry {retry} of {ECOMMERCE_RETRIES}).')
+
+            self.limiter.acquire()
+            try:
+                response = ecommerce_client.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if retry == ECOMMERCE_RETRIES:
+                    raise
+                time.sleep(ECOMMERCE_BACKOFF_FACTOR * 2 ** retry)
+                continue
+
+            if response.status_code == 429:
+                try:
+                    delay = float(response.headers.get('Retry-After', 60))
+                except ValueError:
+                    delay = 60
+                logger.warning(f'Rate limited by ecommerce. Backing off for {delay} seconds.')
+                self.limiter.backoff(delay)
+            elif response.status_code == 401:
+                # The client dropped the rejected JWT, so the retry gets a new one.
+                logger.warning('Ecommerce rejected the access token.')
+            elif response.status_code in (500, 502, 503, 504):
+                if retry < ECOMMERCE_RETRIES:
+                    time.sleep(ECOMMERCE_BACKOFF_FACTOR * 2 ** retry)
+            else:
+                break
+
+        response.raise_for_status()
+        return response
+
+    def get_course(self, key):
+        """
+        Retrieve a course, with its products, from the ecommerce service.
+        """
+        response = self.request(
+            'GET',
+            f'{ECOMMERCE_URL}/api/v2/courses/{key}/',
+            params={'include_products': 'true'},
+        )
+        return response.json()
 
     def update_run(self, key, deadline, *, dry=True):
         """
@@ -185,61 +452,131 @@ class CatClient:
             deadline (datetime.datetime): Upgrade deadline to set for the given run.
 
         Keyword Arguments:
-            dry (bool): Whether to persist changes to the CAT (i.e., ecommerce and LMS).
+            dry (bool): Whether to persist changes to ecommerce (and, through publication, the LMS).
                 You must explicitly indicate when to write data.
         """
-        self.session.visit(f'{self.cat_path}/{key}/edit')
-
-        deadline_input_selector = '#expires'
-        save_button_selector = '.btn-primary'
-        edit_button_selector = '.btn-small'
-
-        # Wait for the upgrade deadline input to render.
-        self.session.wait_for(lambda: self.session.at_css(deadline_input_selector))
-
         formatted_deadline = deadline.strftime('%Y-%m-%dT%H:%M:%S')
 
         if dry:
+            # Dry runs make no requests, so they do not count against the rate limit.
             logger.info(f'This is a dry run. Would have set upgrade deadline for {key} to {formatted_deadline}.')
         else:
             logger.info(f'Setting upgrade deadline for {key} to {formatted_deadline}.')
 
-            self.session.at_css(deadline_input_selector).set(formatted_deadline)
+            course = self.get_course(key)
+            self.request(
+                # AtomicPublicationView only saves through POST and PUT. PUT updates the existing course.
+                'PUT',
+                # The publication route has no trailing slash, unlike the router's routes.
+                f'{ECOMMERCE_URL}/api/v2/publication/{key}',
+                json=build_publication(course, formatted_deadline),
+            )
+
+
+def update_runs(ecommerce, runs, *, dry=True, workers=ECOMMERCE_WORKERS, repair_journal=None):
+    """
+    Set the upgrade deadline of the given runs to 10 days before their end, using a pool of workers.
+
+    Runs can be a stream of runs still being loaded from discovery (see `run_bounded`). If a
+    journal is given, the outcome of each update is recorded in it. Returns the number of
+    runs updated, and the number which failed.
+    """
+    lock = threading.Lock()
+    tally = 0
+    failed = 0
+
+    def update(run):
+        nonlocal tally, failed
+        new_deadline = run.end - datetime.timedelta(days=10)
+
+        outcome = journal.UPDATED
+        error = None
+        try:
+            ecommerce.update_run(run.key, new_deadline, dry=dry)
+        except Exception as exc:
+            logger.exception(f'There was a problem updating run {run.key}. Continuing.')
+            outcome = journal.FAILED
+            error = str(exc)
+
+        # Count the outcome first, so that it is counted exactly once even if it cannot be journaled.
+        with lock:
+            if outcome == journal.FAILED:
+                failed += 1
+            else:
+                tally += 1
+                logger.info(f'{tally} runs updated.')
 
-            # Save and wait for completion.
-            self.session.at_css(save_button_selector).click()
-            self.session.wait_for(lambda: self.session.at_css(edit_button_selector))
+        if repair_journal:
+            repair_journal.record(run.key, outcome, dry=dry, deadline=new_deadline, error=error)
 
-        # Respect the ecommerce service's 50/minute rate limit. Sleeping for
-        # 60 / 50 = 1.2 seconds at a time is an easy way to maximize the number of
-        # requests we can make while staying under the rate limit.
-        sleep(60 / 50)
+    def on_error(run, exc):
+        logger.error(f'There was a problem recording the update of run {run.key}: {exc!r}')
+
+    run_bounded(update, runs, workers, on_error)
+    return tally, failed
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Populate missing upgrade deadlines on verified seats.')
+    parser.add_argument(
+        '--journal',
+        default=REPAIR_JOURNAL,
+        help='Path of the journal recording the outcome of each run update.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Skip the runs which the journal records as already updated.'
+    )
+    parser.add_argument(
+        '--snapshot',
+        default=DISCOVERY_SNAPSHOT,
+        help='Path of a local snapshot of the course runs, refreshed from discovery with conditional requests.'
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='Classify the runs held by the snapshot, without contacting discovery.'
+    )
+    parser.add_argument(
+        '--filter',
+        action='store_true',
+        help='Ask discovery for runs with a verified seat only, and only the fields classified, in larger pages.'
+    )
+    args = parser.parse_args()
+    if args.offline and not args.snapshot:
+        parser.error('--offline requires --snapshot.')
+
     logging.basicConfig(
         style='{',
         format='{asctime} {levelname} {process} [{filename}:{lineno}] - {message}',
         level=logging.INFO
     )
 
-    discovery = DiscoveryClient()
-    discovery.load_runs()
-
-    cat = CatClient()
-    cat.login()
-
-    total = len(discovery.deadline_empty_with_end)
-    logger.info(f'Setting upgrade deadlines for {total} runs.')
+    dry = True
+    repair_journal = journal.Journal(args.journal)
+    completed = set()
+    if args.resume:
+        completed = repair_journal.completed_keys(dry=dry)
+        logger.info(f'Resuming. {len(completed)} runs were already updated, and will be skipped.')
 
-    tally = 0
-    for run in discovery.deadline_empty_with_end:
-        new_deadline = run.end - datetime.timedelta(days=10)
+    course_runs_snapshot = snapshot.Snapshot(args.snapshot) if args.snapshot else None
+    discovery = DiscoveryClient(snapshot=course_runs_snapshot, offline=args.offline, filtered=args.filter)
 
-        try:
-            cat.update_run(run.key, new_deadline, dry=True)
-        except:
-            logger.exception(f'There was a problem updating run {run.key}. Continuing.')
+    # Dry runs never contact ecommerce, so that --offline needs neither network access nor credentials.
+    ecommerce = EcommerceClient(check_credentials=not dry)
 
-        tally += 1
-        logger.info(f'{tally}/{total} runs updated.')
+    # Runs are updated as they are classified, while discovery is still being paginated.
+    runs = (
+        run for category, run in discovery.iter_runs()
+        if category == DEADLINE_EMPTY_WITH_END and run.key not in completed
+    )
+    try:
+        updated, failed = update_runs(ecommerce, runs, dry=dry, repair_journal=repair_journal)
+    finally:
+        repair_journal.close()
+        if course_runs_snapshot:
+            course_runs_snapshot.close()
+
+    discovery.log_summary()
+    logger.info(f'{updated} runs updated, {failed} failed.')
@@ -0,0 +1,180 @@
+import json
+import logging
+import sqlite3
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS crawl (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        count INTEGER NOT NULL,
+        page_size INTEGER NOT NULL,
+        query TEXT NOT NULL,
+        completed_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS page (
+        number INTEGER PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        keys TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS course_run (
+        key TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+'''
+
+
+class Snapshot:
+    """
+    Local copy of the discovery service's course runs, as of the last crawl, stored in SQLite.
+
+    Runs are stored by key. Each page of the crawl is stored with the keys of the runs it
+    contained and with the ETag and Last-Modified validators discovery sent for it, so the
+    next crawl can ask for each page conditionally and reuse the stored runs when the page
+    has not changed. Pages depend on the querystring of the crawl (e.g. filters and page
+    size), so the snapshot is discarded when crawled with a different querystring.
+
+    Pages are only ever read and written from the thread consuming the crawl.
+
+    Arguments:
+        path (str): Path of the SQLite database. It is created if it does not exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def is_complete(self):
+        """
+        Return whether the snapshot holds a completed crawl.
+        """
+        row = self.db.execute('SELECT completed_at FROM crawl WHERE id = 1').fetchone()
+        return bool(row and row[0])
+
+    def count(self):
+        """
+        Return the number of runs discovery reported during the last crawl, or None.
+        """
+        row = self.db.execute('SELECT count FROM crawl WHERE id = 1').fetchone()
+        return row[0] if row else None
+
+    def validators(self, number):
+        """
+        Return the (etag, last_modified) stored for a page, or None if the page is not stored.
+        """
+        return self.db.execute('SELECT etag, last_modified FROM page WHERE number = ?', (number,)).fetchone()
+
+    def page_runs(self, number):
+        """
+        Return the stored runs of a page, in page order.
+        """
+        row = self.db.execute('SELECT keys FROM page WHERE number = ?', (number,)).fetchone()
+        keys = json.loads(row[0])
+        if not keys:
+            return []
+
+        data = dict(self.db.execute(
+            f'SELECT key, data FROM course_run WHERE key IN ({", ".join("?" * len(keys))})',
+            keys,
+        ))
+        return [json.loads(data[key]) for key in keys]
+
+    def query(self):
+        """
+        Return the querystring of the last crawl, without its page number, or None.
+        """
+        row = self.db.execute('SELECT query FROM crawl WHERE id = 1').fetchone()
+        return json.loads(row[0]) if row else None
+
+    def use_query(self, querystring):
+        """
+        Prepare a crawl with the given querystring. If the snapshot was taken with another
+        querystring, its pages do not match the pages of this crawl, and it is discarded.
+        """
+        query = self.query()
+        if query is not None and query != _without_page(querystring):
+            logger.info(f'Discarding the snapshot, which was taken with querystring {query}.')
+            with self.db:
+                self.db.execute('DELETE FROM page')
+                self.db.execute('DELETE FROM course_run')
+                self.db.execute('DELETE FROM crawl')
+
+    def start_crawl(self, count, page_size, querystring):
+        """
+        Record that a crawl of `count` runs, in pages of `page_size`, with the given querystring, has started.
+        """
+        self.db.execute(
+            'INSERT OR REPLACE INTO crawl (id, count, page_size, query, completed_at) VALUES (1, ?, ?, ?, NULL)',
+            (count, page_size, json.dumps(_without_page(querystring))),
+        )
+        self.db.commit()
+
+    def store_page(self, number, runs, etag=None, last_modified=None):
+        """
+        Store a page of runs, and the validators discovery sent for it.
+        """
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO course_run (key, data) VALUES (?, ?)',
+                ((run['key'], json.dumps(run)) for run in runs),
+            )
+            self.db.execute(
+                'INSERT OR REPLACE INTO page (number, etag, last_modified, keys) VALUES (?, ?, ?, ?)',
+                (number, etag, last_modified, json.dumps([run['key'] for run in runs])),
+            )
+
+    def complete_crawl(self, page_count):
+        """
+        Drop the pages and runs which the crawl no longer saw, and mark the crawl as complete.
+        """
+        with self.db:
+            self.db.execute('DELETE FROM page WHERE number > ?', (page_count,))
+
+            seen = set()
+            for (keys,) in self.db.execute('SELECT keys FROM page'):
+                seen.update(json.loads(keys))
+            stale = [
+                (key,) for (key,) in self.db.execute('SELECT key FROM course_run') if key not in seen
+            ]
+            self.db.executemany('DELETE FROM course_run WHERE key = ?', stale)
+
+            self.db.execute(
+                'UPDATE crawl SET completed_at = ? WHERE id = 1',
+                (datetime.utcnow().isoformat(),),
+            )
+
+        logger.info(f'Snapshot complete. Dropped {len(stale)} runs no longer listed by discovery.')
+
+    def iter_pages(self, querystring):
+        """
+        Yield the stored runs of each page of the last completed crawl, in page order.
+
+        Raises RuntimeError unless the crawl was made with the given querystring.
+        """
+        if not self.is_complete():
+            raise RuntimeError(f'{self.path} does not hold a completed crawl of discovery.')
+
+        query = self.query()
+        if query != _without_page(querystring):
+            raise RuntimeError(f'{self.path} was crawled with querystring {query}, not {_without_page(querystring)}.')
+
+        numbers = [number for (number,) in self.db.execute('SELECT number FROM page ORDER BY number')]
+        for number in numbers:
+            yield self.page_runs(number)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _without_page(querystring):
+    return {name: value for name, value in querystring.items() if name != 'page'}
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+import rate_limit
+from rate_limit import TokenBucket
+
+
+class FakeClock:
+    """ Monotonic clock which only moves forward when slept on. """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch.multiple(rate_limit.time, monotonic=self.clock.monotonic, sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(1, capacity=3)
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_waits_for_tokens_at_rate(self):
+        bucket = TokenBucket.per_minute(30)
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.sleeps, [2, 2])
+
+    def test_tokens_do_not_accumulate_past_capacity(self):
+        bucket = TokenBucket(1, capacity=2)
+        self.clock.now += 60
+        for _ in range(3):
+            bucket.acquire()
+
+        self.assertEqual(self.clock.sleeps, [1])
+
+    def test_backoff_blocks_then_resumes_at_rate(self):
+        bucket = TokenBucket(1, capacity=5)
+        bucket.backoff(10)
+        bucket.acquire()
+        bucket.acquire()
+
+        self.assertEqual(self.clock.sleeps, [10, 1, 1])
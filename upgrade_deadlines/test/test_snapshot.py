@@ -0,0 +1,59 @@
+import os
+import unittest
+
+from testfixtures import TempDirectory
+
+from snapshot import Snapshot
+
+QUERYSTRING = {'page': 1, 'page_size': 2}
+
+
+def run(key):
+    return {'key': key, 'seats': []}
+
+
+class SnapshotTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TempDirectory()
+        self.snapshot = Snapshot(os.path.join(self.temp_dir.path, 'snapshot.db'))
+
+    def tearDown(self):
+        self.snapshot.close()
+        self.temp_dir.cleanup()
+
+    def crawl(self, pages, querystring=QUERYSTRING):
+        self.snapshot.use_query(querystring)
+        self.snapshot.start_crawl(sum(len(keys) for keys in pages), 2, querystring)
+        for number, keys in enumerate(pages, start=1):
+            self.snapshot.store_page(number, [run(key) for key in keys], etag=f'"{number}"')
+        self.snapshot.complete_crawl(len(pages))
+
+    def test_complete_crawl(self):
+        self.assertFalse(self.snapshot.is_complete())
+        self.crawl([['a', 'b'], ['c']])
+
+        self.assertTrue(self.snapshot.is_complete())
+        self.assertEqual(self.snapshot.count(), 3)
+        self.assertEqual(self.snapshot.validators(2), ('"2"', None))
+        self.assertEqual(list(self.snapshot.iter_pages(QUERYSTRING)), [[run('a'), run('b')], [run('c')]])
+
+    def test_complete_crawl_drops_stale_pages_and_runs(self):
+        self.crawl([['a', 'b'], ['c', 'd'], ['e']])
+        self.crawl([['a', 'c'], ['d']])
+
+        self.assertIsNone(self.snapshot.validators(3))
+        self.assertEqual(list(self.snapshot.iter_pages(QUERYSTRING)), [[run('a'), run('c')], [run('d')]])
+        keys = [key for (key,) in self.snapshot.db.execute('SELECT key FROM course_run ORDER BY key')]
+        self.assertEqual(keys, ['a', 'c', 'd'])
+
+    def test_other_querystring_discards_snapshot(self):
+        self.crawl([['a', 'b']])
+        filtered = dict(QUERYSTRING, seat_type='verified')
+
+        with self.assertRaises(RuntimeError):
+            list(self.snapshot.iter_pages(filtered))
+
+        self.snapshot.use_query(filtered)
+        self.assertFalse(self.snapshot.is_complete())
+        self.assertIsNone(self.snapshot.validators(1))
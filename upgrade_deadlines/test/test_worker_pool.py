@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from worker_pool import run_bounded
+
+
+class RunBoundedTestCases(unittest.TestCase):
+
+    def test_calls_function_with_every_item(self):
+        seen = []
+        lock = threading.Lock()
+
+        def function(item):
+            with lock:
+                seen.append(item)
+
+        run_bounded(function, iter(range(50)), 4, on_error=self.fail)
+
+        self.assertEqual(sorted(seen), list(range(50)))
+
+    def test_items_are_pulled_as_workers_become_available(self):
+        pulled = 0
+        release = threading.Event()
+
+        def items():
+            nonlocal pulled
+            for item in range(20):
+                pulled += 1
+                yield item
+
+        def function(item):
+            release.wait()
+
+        thread = threading.Thread(target=run_bounded, args=(function, items(), 2, self.fail), daemon=True)
+        thread.start()
+        try:
+            release.wait(0.1)
+            # Two items are being worked on, two more wait for a worker, and the next waits for a slot.
+            self.assertEqual(pulled, 5)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(pulled, 20)
+
+    def test_errors_are_reported_with_their_item(self):
+        errors = []
+
+        def function(item):
+            if item % 2:
+                raise ValueError(item)
+
+        run_bounded(function, range(6), 3, lambda item, exc: errors.append((item, str(exc))))
+
+        self.assertEqual(sorted(errors), [(1, '1'), (3, '3'), (5, '5')])
@@ -0,0 +1,32 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+def run_bounded(function, items, workers, on_error):
+    """
+    Call `function` with each of the given items, using a pool of workers.
+
+    Items are pulled from the given iterable as workers become available, so it can be a
+    stream which is never held in memory: at most `workers * 2` items wait for a worker at
+    a time. If `function` raises, `on_error` is called with the item and the exception.
+    """
+    # Bound the number of items waiting for a worker.
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def call(item):
+        try:
+            function(item)
+        finally:
+            slots.release()
+
+    def check(item, future):
+        # Futures are checked as they complete, rather than kept until the end, so memory stays flat.
+        exc = future.exception()
+        if exc is not None:
+            on_error(item, exc)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            slots.acquire()
+            executor.submit(call, item).add_done_callback(partial(check, item))